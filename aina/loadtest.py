@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Prova de càrrega del chatbot de SmartMetro (/chat o /chat/stream).
+
+Llança peticions concurrents i mostra la latència p50/p95/p99, el temps
+fins al primer fragment (amb --stream) i el throughput. Exemple, contra el
+servidor fals de mock_server.py:
+
+    python aina/loadtest.py --url http://127.0.0.1:8000 --concurrency 20 --requests 200
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+
+
+QUESTIONS = [
+    "Quines són les estacions més transitades?",
+    "Quins intercanviadors té la xarxa?",
+    "Quina línia té més passatgers?",
+    "Com vaig de Catalunya a Sagrada Família?",
+    "Per què serveix la L12?",
+    "Quantes parades té la L5?",
+    "Què aporta l'ampliació de la L1 a Badalona?",
+    "Quina és la mitjana de passatgers per parada de la L3?",
+]
+
+
+def percentile(values: list, q: float) -> float:
+    """Percentil 'q' (0-100) per interpolació lineal."""
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    pos = (len(values) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+def question(i: int, unique: bool) -> str:
+    text = random.choice(QUESTIONS)
+    # Amb --unique cada pregunta és diferent i no aprofita memòria cau ni coalescència
+    return f"{text} (#{i})" if unique else text
+
+
+async def ask(client: httpx.AsyncClient, url: str, message: str, stream: bool) -> dict:
+    start = time.perf_counter()
+    first = None
+    if not stream:
+        resp = await client.post(url + "/chat", json={"message": message})
+        ok = resp.status_code == 200 and not resp.json()["reply"].startswith(("❌", "⚠️", "⏱️"))
+    else:
+        async with client.stream("POST", url + "/chat/stream", json={"message": message}) as resp:
+            ok = resp.status_code == 200
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:") or line == "data: [DONE]":
+                    continue
+                if first is None:
+                    first = time.perf_counter() - start
+                if "error" in json.loads(line[5:]):
+                    ok = False
+    return {"latency": time.perf_counter() - start, "ttfb": first, "ok": ok}
+
+
+async def run(args) -> list:
+    results = []
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(i)
+
+    async def worker(client):
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                results.append(await ask(client, args.url, question(i, args.unique), args.stream))
+            except httpx.HTTPError as e:
+                results.append({"latency": None, "ttfb": None, "ok": False, "error": repr(e)})
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+    return results
+
+
+def report(results: list, elapsed: float, stream: bool):
+    ok = [r for r in results if r["ok"]]
+    latencies = [r["latency"] for r in ok]
+    print(f"Peticions: {len(results)}  correctes: {len(ok)}  errors: {len(results) - len(ok)}")
+    print(f"Temps total: {elapsed:.2f} s  throughput: {len(ok) / elapsed:.2f} resp/s")
+    print("Latència (s):  p50 {:.3f}  p95 {:.3f}  p99 {:.3f}  màx {:.3f}".format(
+        percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99),
+        max(latencies, default=float("nan")),
+    ))
+    if stream:
+        ttfb = [r["ttfb"] for r in ok if r["ttfb"] is not None]
+        print("Primer fragment (s):  p50 {:.3f}  p95 {:.3f}  p99 {:.3f}".format(
+            percentile(ttfb, 50), percentile(ttfb, 95), percentile(ttfb, 99),
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prova de càrrega de /chat")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="URL base del servidor SmartMetro")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--stream", action="store_true", help="Fer servir /chat/stream")
+    parser.add_argument("--unique", action="store_true", help="Preguntes sempre diferents")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = asyncio.run(run(args))
+    report(results, time.perf_counter() - start, args.stream)
+
+
+if __name__ == "__main__":
+    main()
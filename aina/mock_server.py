@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Servidor fals compatible amb l'API OpenAI (/v1/chat/completions) per provar
+el chatbot sense dependre de PublicAI.
+
+Simula latència, velocitat de generació, errors 5xx i límits 429 segons un
+perfil. Per fer-lo servir amb SmartMetro:
+
+    python aina/mock_server.py --profile normal --port 9000
+    PUBLICAI_BASE_URL=http://127.0.0.1:9000/v1/chat/completions \\
+        PUBLICAI_API_KEY=mock uvicorn main:app
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+# latency: segons fins al primer token (mitjana, desviació)
+# tokens_per_second: velocitat de generació
+# error_rate / rate_limit_rate: probabilitat de 500 / 429 per petició
+PROFILES = {
+    "rapid": {"latency": (0.05, 0.01), "tokens_per_second": 400, "error_rate": 0.0, "rate_limit_rate": 0.0},
+    "normal": {"latency": (0.6, 0.2), "tokens_per_second": 40, "error_rate": 0.0, "rate_limit_rate": 0.0},
+    "inestable": {"latency": (0.8, 0.5), "tokens_per_second": 30, "error_rate": 0.1, "rate_limit_rate": 0.0},
+    "saturat": {"latency": (1.5, 0.5), "tokens_per_second": 20, "error_rate": 0.02, "rate_limit_rate": 0.3},
+}
+
+REPLY_WORDS = (
+    "La xarxa de metro de Barcelona té diversos intercanviadors importants com Passeig de Gràcia, "
+    "Diagonal o La Sagrera, on coincideixen línies amb molts passatgers diaris. "
+    "Aquesta és una resposta simulada del servidor de proves."
+).split()
+
+
+def create_app(profile: dict, max_tokens: int = 120, retry_after: float = 1.0) -> FastAPI:
+    app = FastAPI()
+    stats = {"requests": 0, "errors": 0, "rate_limited": 0}
+
+    def reply_words(payload: dict) -> list:
+        n = min(int(payload.get("max_tokens") or max_tokens), max_tokens)
+        return [REPLY_WORDS[i % len(REPLY_WORDS)] for i in range(n)]
+
+    def completion(payload: dict, text: str) -> dict:
+        return {
+            "id": "chatcmpl-" + uuid.uuid4().hex,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"completion_tokens": len(text.split())},
+        }
+
+    def chunk(payload: dict, delta: dict, finish=None) -> str:
+        data = {
+            "object": "chat.completion.chunk",
+            "model": payload.get("model", "mock"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+        }
+        return "data: " + json.dumps(data, ensure_ascii=False) + "\n\n"
+
+    @app.get("/v1/models")
+    def models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model"}]}
+
+    @app.get("/stats")
+    def get_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        stats["requests"] += 1
+
+        draw = random.random()
+        if draw < profile["rate_limit_rate"]:
+            stats["rate_limited"] += 1
+            return JSONResponse({"error": {"message": "Rate limit exceeded"}}, status_code=429,
+                                headers={"Retry-After": str(retry_after)})
+        if draw < profile["rate_limit_rate"] + profile["error_rate"]:
+            stats["errors"] += 1
+            return JSONResponse({"error": {"message": "Simulated server error"}}, status_code=500)
+
+        mean, sd = profile["latency"]
+        await asyncio.sleep(max(0.0, random.gauss(mean, sd)))
+        words = reply_words(payload)
+        token_delay = 1.0 / profile["tokens_per_second"]
+
+        if not payload.get("stream"):
+            await asyncio.sleep(len(words) * token_delay)
+            return completion(payload, " ".join(words))
+
+        async def events():
+            yield chunk(payload, {"role": "assistant"})
+            for i, word in enumerate(words):
+                await asyncio.sleep(token_delay)
+                yield chunk(payload, {"content": word if i == 0 else " " + word})
+            yield chunk(payload, {}, finish="stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor fals compatible amb OpenAI per al chatbot")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="normal")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, help="Latència mitjana fins al primer token (s)")
+    parser.add_argument("--tokens-per-second", type=float)
+    parser.add_argument("--error-rate", type=float, help="Probabilitat de 500")
+    parser.add_argument("--rate-limit-rate", type=float, help="Probabilitat de 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Capçalera Retry-After dels 429 (s)")
+    parser.add_argument("--max-tokens", type=int, default=120, help="Paraules màximes per resposta")
+    args = parser.parse_args()
+
+    profile = dict(PROFILES[args.profile])
+    if args.latency is not None:
+        profile["latency"] = (args.latency, profile["latency"][1])
+    for name in ("tokens_per_second", "error_rate", "rate_limit_rate"):
+        if getattr(args, name) is not None:
+            profile[name] = getattr(args, name)
+
+    print(f"Perfil {args.profile}: {profile}")
+    uvicorn.run(create_app(profile, args.max_tokens, args.retry_after), host=args.host, port=args.port,
+                log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
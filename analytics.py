@@ -0,0 +1,444 @@
+import hashlib
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+try:
+    # Opcional: instantània columnar d'estacions.csv
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+ESTACIONS_CSV = os.path.join("static", "data", "estacions.csv")
+SNAPSHOT_VERSION_KEY = b"smartmetro_source_sha1"
+
+
+LINE_PATTERN = r"(L\d+S?)"
+
+
+def read_stations_csv(csv_path: str = ESTACIONS_CSV) -> pd.DataFrame:
+    """Llegeix el CSV d'estacions i en fa les coercions de tipus."""
+    df = pd.read_csv(csv_path)
+
+    # Tipus
+    df["DATA"] = pd.to_datetime(df["DATA"], errors="coerce")
+    df["PERSONA"] = pd.to_numeric(df["PERSONA"], errors="coerce")
+    df["lon"] = pd.to_numeric(df["lon"], errors="coerce")
+    df["lat"] = pd.to_numeric(df["lat"], errors="coerce")
+
+    # Neteja mínima
+    df = df.dropna(subset=["NOM_ESTACIO", "PERSONA", "lon", "lat"]).reset_index(drop=True)
+    df["PICTO"] = df["PICTO"].fillna("").astype(str)
+
+    return df
+
+
+def snapshot_path(csv_path: str) -> str:
+    """Fitxer Parquet de la instantània tipada, al costat del CSV."""
+    return os.path.splitext(csv_path)[0] + ".parquet"
+
+
+def write_stations_snapshot(df: pd.DataFrame, csv_path: str, version: str):
+    """
+    Desa el DataFrame ja tipat en Parquet. El hash del CSV origen es guarda
+    a les metadades de l'esquema per poder detectar si la instantània és vella.
+    """
+    if pa is None:
+        return False
+
+    path = snapshot_path(csv_path)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SNAPSHOT_VERSION_KEY] = version.encode()
+    table = table.replace_schema_metadata(metadata)
+    tmp_path = path + ".tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+    return True
+
+
+def read_stations_snapshot(csv_path: str, version: str):
+    """
+    Carrega la instantània Parquet amb memory-map si existeix i correspon a
+    'version'. Retorna None si cal tornar a llegir el CSV.
+    """
+    if pa is None:
+        return None
+
+    path = snapshot_path(csv_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+        if metadata.get(SNAPSHOT_VERSION_KEY) != version.encode():
+            return None
+        return pq.read_table(path, memory_map=True).to_pandas()
+    except (OSError, pa.ArrowException) as e:
+        print(f"Instantània {path} il·legible, es torna a llegir el CSV: {e}")
+        return None
+
+
+def load_stations(csv_path: str = ESTACIONS_CSV, version: str | None = None) -> pd.DataFrame:
+    """
+    Retorna el DataFrame d'estacions des de la instantània Parquet si és
+    fresca i, si no, des del CSV, regenerant la instantània de passada.
+    """
+    if version is None:
+        version = file_digest(csv_path)
+
+    df = read_stations_snapshot(csv_path, version)
+    if df is not None:
+        return df
+
+    df = read_stations_csv(csv_path)
+    try:
+        write_stations_snapshot(df, csv_path, version)
+    except (OSError, ValueError, TypeError) as e:
+        print(f"No s'ha pogut desar la instantània Parquet: {e}")
+    return df
+
+
+def line_membership(df: pd.DataFrame):
+    """
+    Pertinença a línies com a matrius booleanes, calculades un sol cop per
+    cada valor diferent i no per fila:
+    - picto_lines: PICTO × línia (L1, L3, L9S...)
+    - station_lines: NOM_ESTACIO × línia (unió dels PICTO de l'estació)
+    """
+    codes = pd.Series(df["PICTO"].unique())
+    found = codes.str.extractall(LINE_PATTERN)[0]
+    lines = sorted(found.unique().tolist())
+
+    picto_lines = pd.DataFrame(False, index=range(len(codes)), columns=lines)
+    if len(found):
+        dummies = pd.get_dummies(found).groupby(level=0).max()
+        picto_lines.loc[dummies.index, dummies.columns] = dummies.astype(bool)
+    picto_lines.index = pd.Index(codes, name="PICTO")
+
+    pairs = df[["NOM_ESTACIO", "PICTO"]].drop_duplicates()
+    station_lines = (
+        picto_lines.reindex(pairs["PICTO"])
+        .set_axis(pairs["NOM_ESTACIO"])
+        .groupby(level=0)
+        .max()
+    )
+
+    return picto_lines, station_lines
+
+
+def summarize_stations(df: pd.DataFrame, station_lines: pd.DataFrame):
+    all_lines = station_lines.columns[station_lines.any(axis=0)].tolist()
+
+    totals = df.groupby("NOM_ESTACIO")["PERSONA"].sum()
+
+    # Top 10 estacions per volum total
+    top_estacions = (
+        totals.rename("total_persones")
+        .sort_values(ascending=False)
+        .head(10)
+        .reset_index()
+    )
+
+    # Intercanviadors: estacions amb més d'una línia
+    num_linies = station_lines.sum(axis=1)
+    hubs = station_lines[num_linies > 1]
+    intercanviadors = pd.DataFrame({
+        "NOM_ESTACIO": hubs.index,
+        "total_persones": totals.reindex(hubs.index).to_numpy(),
+        "linies": hubs.dot(hubs.columns + ", ").str[:-2].to_numpy(),
+        "num_linies": num_linies[hubs.index].to_numpy(),
+    })
+    intercanviadors = intercanviadors.sort_values("total_persones", ascending=False).reset_index(drop=True)
+
+    return all_lines, top_estacions, intercanviadors
+
+
+def process_data(csv_path: str = ESTACIONS_CSV, version: str | None = None):
+    df = load_stations(csv_path, version)
+    picto_lines, station_lines = line_membership(df)
+    all_lines, top_estacions, intercanviadors = summarize_stations(df, station_lines)
+    return df, picto_lines, station_lines, all_lines, top_estacions, intercanviadors
+
+
+def compute_line_metrics(df: pd.DataFrame, picto_lines: pd.DataFrame, station_lines: pd.DataFrame) -> pd.DataFrame:
+    # Cada fila compta a totes les línies del seu PICTO
+    picto_totals = df.groupby("PICTO")["PERSONA"].sum().reindex(picto_lines.index, fill_value=0)
+    line_stats = pd.DataFrame({
+        "LINIA": picto_lines.columns,
+        "num_parades": station_lines.sum(axis=0).to_numpy(),
+        "total_persones": picto_totals.to_numpy() @ picto_lines.to_numpy(),
+    })
+    line_stats = line_stats[line_stats["num_parades"] > 0]
+
+    line_stats["mitjana_per_parada"] = (
+        line_stats["total_persones"] / line_stats["num_parades"]
+    )
+
+    return line_stats.sort_values("total_persones", ascending=False)
+
+
+GRANULARITIES = ("day", "week", "month")
+
+
+class RidershipCube:
+    """
+    Cub de passatgers per dia i per parella (estació, PICTO), guardat com a
+    sumes acumulades sobre l'eix temporal. Qualsevol interval de dates, a
+    qualsevol granularitat, es respon amb restes entre files del cub sense
+    tornar a agrupar el DataFrame original.
+    """
+
+    def __init__(self, first_day, num_days, prefix, pair_station, pair_lines, stations, lines):
+        self.first_day = first_day
+        self.num_days = num_days
+        self.prefix = prefix              # (num_days + 1) × parelles
+        self.pair_station = pair_station  # índex d'estació de cada parella
+        self.pair_lines = pair_lines      # parelles × línies (bool)
+        self.stations = stations          # pd.Index de noms d'estació
+        self.lines = lines                # pd.Index de codis de línia
+
+        days = pd.date_range(first_day, periods=num_days, freq="D")
+        self.period_starts = {
+            "day": np.arange(num_days),
+            "week": np.flatnonzero(days.dayofweek == 0),
+            "month": np.flatnonzero(days.day == 1),
+        }
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, picto_lines: pd.DataFrame) -> "RidershipCube":
+        df = df[df["DATA"].notna()]
+        day = df["DATA"].dt.normalize()
+        first_day = day.min() if len(df) else pd.Timestamp("1970-01-01")
+        num_days = (day.max() - first_day).days + 1 if len(df) else 0
+
+        pair_codes, pairs = pd.MultiIndex.from_frame(df[["NOM_ESTACIO", "PICTO"]]).factorize()
+        stations = pd.Index(sorted(pairs.get_level_values(0).unique()))
+
+        daily = np.zeros((num_days, len(pairs)))
+        np.add.at(daily, ((day - first_day).dt.days.to_numpy(), pair_codes), df["PERSONA"].to_numpy(dtype=float))
+        prefix = np.vstack([np.zeros((1, len(pairs))), daily.cumsum(axis=0)])
+
+        return cls(
+            first_day=first_day,
+            num_days=num_days,
+            prefix=prefix,
+            pair_station=stations.get_indexer(pairs.get_level_values(0)),
+            pair_lines=picto_lines.reindex(pairs.get_level_values(1), fill_value=False).to_numpy(),
+            stations=stations,
+            lines=picto_lines.columns,
+        )
+
+    def _lookup(self, index: pd.Index, values, kind: str):
+        positions = index.get_indexer(values)
+        unknown = [v for v, p in zip(values, positions) if p < 0]
+        if unknown:
+            raise ValueError(f"{kind} desconeguda: {', '.join(unknown)}")
+        return positions
+
+    def query(self, start=None, end=None, granularity: str = "day", stations=None, lines=None) -> dict:
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Granularitat no vàlida: {granularity} (opcions: {', '.join(GRANULARITIES)})")
+
+        start = pd.Timestamp(start) if start is not None else self.first_day
+        end = pd.Timestamp(end) if end is not None else self.first_day + pd.Timedelta(days=self.num_days - 1)
+        if start > end:
+            raise ValueError("La data inicial és posterior a la final.")
+
+        # Interval de files del cub [i0, i1)
+        i0 = int(np.clip((start - self.first_day).days, 0, self.num_days))
+        i1 = int(np.clip((end - self.first_day).days + 1, 0, self.num_days))
+
+        mask = np.ones(len(self.pair_station), dtype=bool)
+        station_pos = line_pos = None
+        if stations:
+            station_pos = self._lookup(self.stations, stations, "Estació")
+            mask &= np.isin(self.pair_station, station_pos)
+        if lines:
+            line_pos = self._lookup(self.lines, lines, "Línia")
+            mask &= self.pair_lines[:, line_pos].any(axis=1)
+
+        result = {
+            "from": start.date().isoformat(),
+            "to": end.date().isoformat(),
+            "granularity": granularity,
+            "stations": list(stations or []),
+            "lines": list(lines or []),
+            "series": [],
+            "total_persones": 0.0,
+        }
+        if i0 >= i1:
+            return result
+
+        starts = self.period_starts[granularity]
+        edges = np.concatenate([[i0], starts[(starts > i0) & (starts < i1)], [i1]])
+        buckets = self.prefix[edges[1:]][:, mask] - self.prefix[edges[:-1]][:, mask]
+        totals = buckets.sum(axis=1)
+
+        first = self.first_day
+        result["series"] = [
+            {
+                "inici": (first + pd.Timedelta(days=int(a))).date().isoformat(),
+                "fi": (first + pd.Timedelta(days=int(b) - 1)).date().isoformat(),
+                "total_persones": float(t),
+            }
+            for a, b, t in zip(edges[:-1], edges[1:], totals)
+        ]
+        result["total_persones"] = float(totals.sum())
+
+        # Desglossament per línia o per estació quan s'han filtrat
+        if line_pos is not None:
+            by_line = buckets @ self.pair_lines[mask][:, line_pos]
+            result["per_linia"] = {
+                self.lines[p]: by_line[:, k].tolist() for k, p in enumerate(line_pos)
+            }
+        if station_pos is not None:
+            pair_station = self.pair_station[mask]
+            result["per_estacio"] = {
+                self.stations[p]: buckets[:, pair_station == p].sum(axis=1).tolist() for p in station_pos
+            }
+
+        return result
+
+
+def file_digest(path: str) -> str:
+    """Hash SHA-1 del contingut d'un fitxer, llegit per blocs."""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+@dataclass
+class AnalyticsSnapshot:
+    """
+    Agregats del dashboard calculats a partir d'una versió concreta del CSV.
+    'version' és el hash del fitxer origen i identifica les dades.
+    """
+    version: str
+    df: pd.DataFrame
+    picto_lines: pd.DataFrame
+    station_lines: pd.DataFrame
+    all_lines: list
+    top_estacions_df: pd.DataFrame
+    intercanviadors_df: pd.DataFrame
+    line_stats_df: pd.DataFrame
+    total_passatgers: int
+    mitjana_passatgers: float
+    num_estacions: int
+    num_linies: int
+    line_stats: list
+    line_labels: list
+    line_totals: list
+    top_estacions: list
+    intercanviadors: list
+    # Resultats derivats (per exemple JSON serialitzat) lligats a aquesta versió
+    cache: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def build(cls, csv_path: str, version: str) -> "AnalyticsSnapshot":
+        df, picto_lines, station_lines, all_lines, top_estacions_df, intercanviadors_df = process_data(csv_path, version)
+        line_stats_df = compute_line_metrics(df, picto_lines, station_lines)
+
+        return cls(
+            version=version,
+            df=df,
+            picto_lines=picto_lines,
+            station_lines=station_lines,
+            all_lines=all_lines,
+            top_estacions_df=top_estacions_df,
+            intercanviadors_df=intercanviadors_df,
+            line_stats_df=line_stats_df,
+            # KPIs globals
+            total_passatgers=int(df["PERSONA"].sum()),
+            mitjana_passatgers=float(df["PERSONA"].mean()),
+            num_estacions=int(df["NOM_ESTACIO"].nunique()),
+            num_linies=len(all_lines),
+            # Per Jinja
+            line_stats=line_stats_df.to_dict(orient="records"),
+            line_labels=line_stats_df["LINIA"].tolist(),
+            line_totals=line_stats_df["total_persones"].astype(int).tolist(),
+            top_estacions=top_estacions_df.to_dict(orient="records"),
+            intercanviadors=intercanviadors_df.to_dict(orient="records"),
+        )
+
+    @property
+    def ridership(self) -> RidershipCube:
+        return self.cached("ridership", lambda: RidershipCube.build(self.df, self.picto_lines))
+
+    @property
+    def station_coords(self) -> pd.DataFrame:
+        """lon/lat de cada estació (primera aparició al CSV)."""
+        return self.cached("station_coords", lambda: self.df.groupby("NOM_ESTACIO")[["lon", "lat"]].first())
+
+    def cached(self, key, builder):
+        """Retorna un valor derivat d'aquesta versió, calculant-lo només la primera vegada."""
+        if key not in self.cache:
+            self.cache[key] = builder()
+        return self.cache[key]
+
+
+class AnalyticsEngine:
+    """
+    Motor d'analítica amb càrrega mandrosa.
+
+    Els agregats no es calculen en importar el mòdul sinó la primera vegada
+    que es demanen. Cada 'check_interval' segons es comprova el mtime/mida del
+    CSV; si ha canviat, es recalcula el hash del contingut i només es
+    reconstrueixen els agregats si el contingut és realment diferent.
+    """
+
+    def __init__(self, csv_path: str = ESTACIONS_CSV, check_interval: float = 5.0):
+        self.csv_path = csv_path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._stat_key = None
+        self._last_check = 0.0
+
+    def _stat(self):
+        st = os.stat(self.csv_path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def snapshot(self) -> AnalyticsSnapshot:
+        current = self._snapshot
+        if current is not None and time.monotonic() - self._last_check < self.check_interval:
+            return current
+
+        with self._lock:
+            stat_key = self._stat()
+            self._last_check = time.monotonic()
+            if self._snapshot is not None and stat_key == self._stat_key:
+                return self._snapshot
+
+            version = file_digest(self.csv_path)
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = AnalyticsSnapshot.build(self.csv_path, version)
+            self._stat_key = stat_key
+            return self._snapshot
+
+    @property
+    def version(self) -> str:
+        return self.snapshot().version
+
+
+if __name__ == "__main__":
+    # Pas de build: genera la instantània Parquet d'estacions.csv
+    import sys
+
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else ESTACIONS_CSV
+    if pa is None:
+        print("Error: cal 'pyarrow' per generar la instantània (pip install pyarrow).")
+        sys.exit(1)
+
+    version = file_digest(csv_path)
+    df = read_stations_csv(csv_path)
+    write_stations_snapshot(df, csv_path, version)
+    print(f"Instantània generada per {csv_path} (versió {version[:12]}): {snapshot_path(csv_path)}")
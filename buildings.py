@@ -1,46 +1,238 @@
-import geopandas as gpd
-import sys
+import argparse
+import json
 import os
+import sys
+
+import geopandas as gpd
+import pyproj
+
+try:
+    # Opcional: lectura por lotes (Arrow) y escritura GeoParquet/FlatGeobuf incremental
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyogrio
+except ImportError:
+    pyogrio = None
 
 # --- Nombres de los archivos ---
 gml_file = "static/data/hospitalet_buildings.gml"
 geojson_file = "static/data/hospitalet_buildings.geojson"
 # ------------------------------
 
-print(f"Iniciando la conversión de '{gml_file}' a '{geojson_file}'...")
+# CRS de salida y tamaño de lote (edificios por lote) del modo por lotes
+TARGET_CRS = "EPSG:4326"
+BATCH_SIZE = 50000
 
-# 1. Comprobar si el archivo de entrada existe
-if not os.path.exists(gml_file):
-    print(f"Error: No se encontró el archivo '{gml_file}' en esta carpeta.")
-    print("Por favor, asegúrate de que el archivo GML está en el mismo directorio que este script.")
-    sys.exit(1)
+# Formato de salida según la extensión
+OUTPUT_DRIVERS = {
+    ".parquet": "Parquet",
+    ".fgb": "FlatGeobuf",
+    ".geojson": "GeoJSON",
+}
+GEOMETRY_COLUMN = "geometry"
+
+
+def convertir_gml(gml_file, geojson_file):
+    """Conversión original: lee el GML entero en memoria y lo guarda como GeoJSON."""
+    print(f"Iniciando la conversión de '{gml_file}' a '{geojson_file}'...")
+
+    # 1. Comprobar si el archivo de entrada existe
+    if not os.path.exists(gml_file):
+        print(f"Error: No se encontró el archivo '{gml_file}' en esta carpeta.")
+        print("Por favor, asegúrate de que el archivo GML está en el mismo directorio que este script.")
+        sys.exit(1)
+
+    try:
+        # 2. Leer el archivo GML con geopandas
+        # Geopandas (fiona/gdal) detectará el CRS (Sistema de Coordenadas)
+        # y analizará la estructura compleja de INSPIRE.
+        print(f"Leyendo '{gml_file}'... (Esto puede tardar un momento si el archivo es grande)")
+        gdf = gpd.read_file(gml_file)
+
+        print(f"Archivo GML leído con éxito. Contiene {len(gdf)} edificios.")
+        print(f"El CRS (Sistema de Coordenadas) original es: {gdf.crs}")
+
+        # 3. Reproyectar a EPSG:4326 (WGS 84)
+        # Es el estándar obligatorio para GeoJSON.
+        print("Reproyectando coordenadas a EPSG:4326 (WGS 84)...")
+        gdf_wgs84 = gdf.to_crs("EPSG:4326")
+
+        # 4. Guardar el resultado como GeoJSON
+        print(f"Guardando el archivo GeoJSON como '{geojson_file}'...")
+        gdf_wgs84.to_file(geojson_file, driver="GeoJSON")
+
+        print("\n--- ¡Éxito! ---")
+        print(f"El archivo '{geojson_file}' ha sido creado correctamente.")
+
+    except Exception as e:
+        print(f"\n--- ¡Error durante la conversión! ---")
+        print(f"Detalle del error: {e}")
+        print("\nPosibles causas:")
+        print("1. ¿Está 'geopandas' y sus dependencias (GDAL) instalados correctamente?")
+        print("   (Recuerda: 'conda install -c conda-forge geopandas' es la forma más fácil)")
+        print("2. El archivo GML podría estar dañado o tener una estructura inesperada.")
+
+
+def leer_lotes(path, batch_size=BATCH_SIZE):
+    """
+    Itera el archivo en lotes de 'batch_size' edificios como tablas Arrow,
+    junto con el CRS y el nombre de la columna de geometría (WKB).
+    """
+    with pyogrio.open_arrow(path, batch_size=batch_size, use_pyarrow=True) as (meta, reader):
+        geom_col = meta["geometry_name"] or "wkb_geometry"
+        for batch in reader:
+            yield pa.Table.from_batches([batch]), meta["crs"], geom_col
 
-try:
-    # 2. Leer el archivo GML con geopandas
-    # Geopandas (fiona/gdal) detectará el CRS (Sistema de Coordenadas)
-    # y analizará la estructura compleja de INSPIRE.
-    print(f"Leyendo '{gml_file}'... (Esto puede tardar un momento si el archivo es grande)")
-    gdf = gpd.read_file(gml_file)
 
-    print(f"Archivo GML leído con éxito. Contiene {len(gdf)} edificios.")
-    print(f"El CRS (Sistema de Coordenadas) original es: {gdf.crs}")
+def reproyectar_lote(table, crs, geom_col, target_crs=TARGET_CRS):
+    """Reproyecta la geometría del lote y la deja como WKB en la columna 'geometry'."""
+    geoms = gpd.GeoSeries.from_wkb(table.column(geom_col).to_numpy(zero_copy_only=False), crs=crs)
+    if crs is not None and geoms.crs != target_crs:
+        geoms = geoms.to_crs(target_crs)
+    wkb = pa.array(geoms.to_wkb(), type=pa.binary())
+    return table.set_column(table.schema.get_field_index(geom_col), GEOMETRY_COLUMN, wkb)
 
-    # 3. Reproyectar a EPSG:4326 (WGS 84)
-    # Es el estándar obligatorio para GeoJSON.
-    print("Reproyectando coordenadas a EPSG:4326 (WGS 84)...")
-    gdf_wgs84 = gdf.to_crs("EPSG:4326")
 
-    # 4. Guardar el resultado como GeoJSON
-    print(f"Guardando el archivo GeoJSON como '{geojson_file}'...")
-    gdf_wgs84.to_file(geojson_file, driver="GeoJSON")
+def ajustar_esquema(table, schema):
+    """
+    Adapta un lote al esquema del primer lote (otros municipios pueden traer
+    columnas de más, de menos o con otro tipo).
+    """
+    columnas = []
+    for field in schema:
+        if field.name in table.column_names:
+            columnas.append(table.column(field.name).cast(field.type))
+        else:
+            columnas.append(pa.nulls(table.num_rows, type=field.type))
+    return pa.Table.from_arrays(columnas, schema=schema)
+
+
+def geo_metadata(crs):
+    """Metadatos 'geo' de GeoParquet 1.0 para la columna de geometría WKB."""
+    return {
+        "version": "1.0.0",
+        "primary_column": GEOMETRY_COLUMN,
+        "columns": {
+            GEOMETRY_COLUMN: {
+                "encoding": "WKB",
+                "geometry_types": [],
+                "crs": pyproj.CRS.from_user_input(crs).to_json_dict(),
+            },
+        },
+    }
+
+
+class EscritorLotes:
+    """
+    Escribe lotes Arrow en uno o varios formatos sin acumularlos en memoria:
+    GeoParquet con un ParquetWriter, FlatGeobuf añadiendo capa a capa con
+    pyogrio y GeoJSON feature a feature.
+    """
+
+    def __init__(self, outputs, target_crs=TARGET_CRS):
+        self.outputs = outputs
+        self.target_crs = target_crs
+        self.schema = None
+        self.count = 0
+        self._parquet = {}
+        self._geojson = {}
+
+    def __enter__(self):
+        for path in self.outputs:
+            if os.path.exists(path):
+                os.remove(path)
+        return self
+
+    def _abrir(self, table):
+        self.schema = table.schema.with_metadata(
+            {b"geo": json.dumps(geo_metadata(self.target_crs)).encode("utf-8")}
+        )
+        for path in self.outputs:
+            driver = OUTPUT_DRIVERS[os.path.splitext(path)[1]]
+            if driver == "Parquet":
+                self._parquet[path] = pq.ParquetWriter(path, self.schema, compression="zstd")
+            elif driver == "GeoJSON":
+                from poblacion import CRS_LONLAT, EscritorGeoJSON
+
+                crs = CRS_LONLAT if self.target_crs == "EPSG:4326" else None
+                name = os.path.splitext(os.path.basename(path))[0]
+                self._geojson[path] = EscritorGeoJSON(path, name, crs=crs).__enter__()
+
+    def write(self, table):
+        if self.schema is None:
+            self._abrir(table)
+        table = ajustar_esquema(table, self.schema)
+
+        for path in self.outputs:
+            driver = OUTPUT_DRIVERS[os.path.splitext(path)[1]]
+            if driver == "Parquet":
+                self._parquet[path].write_table(table)
+            elif driver == "GeoJSON":
+                gdf = gpd.GeoDataFrame(
+                    table.drop_columns([GEOMETRY_COLUMN]).to_pandas(),
+                    geometry=gpd.GeoSeries.from_wkb(table.column(GEOMETRY_COLUMN).to_numpy(zero_copy_only=False)),
+                )
+                for feature in json.loads(gdf.to_json(drop_id=True))["features"]:
+                    self._geojson[path].write(feature)
+            else:
+                pyogrio.write_arrow(
+                    table, path, driver=driver, geometry_name=GEOMETRY_COLUMN,
+                    geometry_type="Unknown", crs=self.target_crs, append=os.path.exists(path),
+                )
+        self.count += table.num_rows
+
+    def __exit__(self, exc_type, exc, tb):
+        for writer in self._parquet.values():
+            writer.close()
+        for writer in self._geojson.values():
+            writer.__exit__(exc_type, exc, tb)
+
+
+def convertir_por_lotes(gml_files, outputs, batch_size=BATCH_SIZE, target_crs=TARGET_CRS):
+    """
+    Convierte uno o varios GML sin cargarlos enteros: cada lote se lee con
+    pyogrio (Arrow), se reproyecta y se añade a las salidas. La memoria
+    depende del tamaño del lote, no del tamaño del municipio.
+    """
+    if pyogrio is None:
+        print("Error: el modo por lotes necesita 'pyogrio' y 'pyarrow'.")
+        sys.exit(1)
+
+    for path in outputs:
+        if os.path.splitext(path)[1] not in OUTPUT_DRIVERS:
+            print(f"Error: formato de salida no soportado: '{path}' (usa {', '.join(OUTPUT_DRIVERS)}).")
+            sys.exit(1)
+
+    with EscritorLotes(outputs, target_crs) as writer:
+        for gml in gml_files:
+            if not os.path.exists(gml):
+                print(f"Error: No se encontró el archivo '{gml}'. Saltando.")
+                continue
+
+            print(f"Leyendo '{gml}' en lotes de {batch_size} edificios...")
+            leidos = 0
+            for table, crs, geom_col in leer_lotes(gml, batch_size):
+                writer.write(reproyectar_lote(table, crs, geom_col, target_crs))
+                leidos += table.num_rows
+            print(f" -> {leidos} edificios convertidos")
 
     print("\n--- ¡Éxito! ---")
-    print(f"El archivo '{geojson_file}' ha sido creado correctamente.")
-
-except Exception as e:
-    print(f"\n--- ¡Error durante la conversión! ---")
-    print(f"Detalle del error: {e}")
-    print("\nPosibles causas:")
-    print("1. ¿Está 'geopandas' y sus dependencias (GDAL) instalados correctamente?")
-    print("   (Recuerda: 'conda install -c conda-forge geopandas' es la forma más fácil)")
-    print("2. El archivo GML podría estar dañado o tener una estructura inesperada.")
\ No newline at end of file
+    print(f"Total de edificios: {writer.count}")
+    for path in outputs:
+        print(f"Archivo guardado en: {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convierte edificios INSPIRE (GML) a GeoJSON, GeoParquet o FlatGeobuf.")
+    parser.add_argument("gml", nargs="*", help="archivos GML de entrada (sin argumentos: conversión original de L'Hospitalet)")
+    parser.add_argument("-o", "--salida", nargs="+", default=None,
+                        help="archivos de salida (.parquet, .fgb o .geojson); todos los GML se añaden a ellos")
+    parser.add_argument("--lote", type=int, default=BATCH_SIZE, help="edificios por lote")
+    parser.add_argument("--crs", default=TARGET_CRS, help="CRS de salida")
+    args = parser.parse_args()
+
+    if not args.gml:
+        convertir_gml(gml_file, geojson_file)
+    else:
+        salidas = args.salida or [os.path.splitext(args.gml[0])[0] + ".parquet"]
+        convertir_por_lotes(args.gml, salidas, args.lote, args.crs)
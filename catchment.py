@@ -0,0 +1,277 @@
+import argparse
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from analytics import line_membership, load_stations
+from propostes import load_proposed_stops
+
+try:
+    import geopandas as gpd
+    import shapely
+    from pyproj import Transformer
+except ImportError:
+    # Sense aquestes llibreries el servidor funciona però sense àrees d'influència
+    gpd = None
+    shapely = None
+    Transformer = None
+
+try:
+    # Opcional: càlcul en bloc de totes les àrees d'influència
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+DATA_DIR = os.path.join("static", "data")
+POPULATION_POINTS_FILE = os.path.join(DATA_DIR, "population_points.geojson")
+SERVEIS_FILE = os.path.join(DATA_DIR, "serveis.geojson")
+
+# Coordenades projectades en metres (ETRS89 / UTM 31N) per mesurar radis
+CATCHMENT_CRS = "EPSG:25831"
+MAX_RADIUS = 3000
+
+# Radis (metres a peu) de la taula precalculada
+CATCHMENT_RADII = (300, 500, 800)
+CATCHMENTS_FILE = os.path.join(DATA_DIR, "catchments.csv")
+
+
+class PointIndex:
+    """
+    Capa de punts projectada a EPSG:25831 i indexada amb un STRtree. Es
+    carrega a la primera consulta i es recarrega si el fitxer canvia.
+    """
+
+    def __init__(self, path: str, weight: str | None = None, category: str | None = None):
+        self.path = path
+        self.weight = weight
+        self.category = category
+
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._tree = None
+        self._xy = None
+        self._weights = None
+        self._categories = None
+
+    @property
+    def available(self) -> bool:
+        return gpd is not None and os.path.exists(self.path)
+
+    @property
+    def mtime(self):
+        return os.path.getmtime(self.path) if os.path.exists(self.path) else None
+
+    def _load(self):
+        mtime = os.path.getmtime(self.path)
+        if self._tree is not None and mtime == self._mtime:
+            return
+
+        with self._lock:
+            if self._tree is not None and mtime == self._mtime:
+                return
+
+            gdf = gpd.read_file(self.path)
+            gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+            if gdf.crs is None:
+                gdf = gdf.set_crs("EPSG:4326")
+            points = gdf.to_crs(CATCHMENT_CRS).geometry.representative_point().values
+
+            if self.weight and self.weight in gdf.columns:
+                self._weights = gdf[self.weight].fillna(0).to_numpy(dtype=float)
+            else:
+                self._weights = np.ones(len(gdf))
+            if self.category and self.category in gdf.columns:
+                self._categories = gdf[self.category].fillna("").astype(str).to_numpy()
+            else:
+                self._categories = np.full(len(gdf), "", dtype=object)
+
+            self._xy = shapely.get_coordinates(points)
+            self._tree = shapely.STRtree(points)
+            self._mtime = mtime
+
+    def points(self):
+        """Coordenades (n, 2) en EPSG:25831, pesos i categories de tots els punts."""
+        self._load()
+        return self._xy, self._weights, self._categories
+
+    def within(self, x: float, y: float, radius: float):
+        """Índexs dels punts a menys de 'radius' metres de (x, y) en EPSG:25831."""
+        self._load()
+        idx = self._tree.query(shapely.Point(x, y), predicate="dwithin", distance=radius)
+        idx.sort()
+        return idx
+
+
+class CatchmentIndex:
+    """
+    Àrea d'influència d'una estació: població i serveis a menys de N metres.
+
+    Cada resultat es guarda en una LRU per (estació, radi) que es buida quan
+    canvia algun dels fitxers de punts.
+    """
+
+    def __init__(self, population_path: str = POPULATION_POINTS_FILE, services_path: str = SERVEIS_FILE,
+                 cache_size: int = 4096):
+        self.population = PointIndex(population_path, weight="poblacion_estimada")
+        self.services = PointIndex(services_path, category="category")
+        self.cache_size = cache_size
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._version = None
+        self._to_utm = Transformer.from_crs("EPSG:4326", CATCHMENT_CRS, always_xy=True) if Transformer else None
+
+    @property
+    def available(self) -> bool:
+        return self.population.available
+
+    @property
+    def version(self):
+        return self.population.mtime, self.services.mtime
+
+    def project(self, lon, lat):
+        """lon/lat (EPSG:4326) a metres en EPSG:25831."""
+        return self._to_utm.transform(lon, lat)
+
+    def _compute(self, lon: float, lat: float, radius: float) -> dict:
+        x, y = self.project(lon, lat)
+
+        idx = self.population.within(x, y, radius)
+        _, weights, _ = self.population.points()
+        result = {
+            "radi_m": radius,
+            "edificis_residencials": int(len(idx)),
+            "poblacio": round(float(weights[idx].sum()), 1),
+            "serveis": None,
+        }
+
+        if self.services.available:
+            idx = self.services.within(x, y, radius)
+            _, _, categories = self.services.points()
+            names, counts = np.unique(categories[idx].astype(str), return_counts=True)
+            result["serveis"] = {
+                "total": int(len(idx)),
+                "per_categoria": {n or "altres": int(c) for n, c in zip(names.tolist(), counts.tolist())},
+            }
+        return result
+
+    def query(self, key, lon: float, lat: float, radius: float) -> dict:
+        """Àrea d'influència de 'key' (p. ex. el nom de l'estació) situada a lon/lat."""
+        version = self.version
+        cache_key = (key, lon, lat, radius)
+        with self._lock:
+            if self._version != version:
+                self._cache.clear()
+                self._version = version
+            if cache_key in self._cache:
+                self._cache.move_to_end(cache_key)
+                return self._cache[cache_key]
+
+        result = self._compute(lon, lat, radius)
+
+        with self._lock:
+            self._cache[cache_key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+
+def population_within(centres_xy, points_xy, weights, radii=CATCHMENT_RADII) -> np.ndarray:
+    """
+    Població a menys de cada radi per a tots els centres alhora (n_centres ×
+    n_radis). Una sola consulta de KD-tree al radi màxim dona totes les
+    parelles centre-punt; després cada radi és un filtre i un bincount.
+    """
+    centres = cKDTree(centres_xy)
+    points = cKDTree(points_xy)
+    pairs = centres.sparse_distance_matrix(points, max(radii), output_type="ndarray")
+
+    result = np.zeros((len(centres_xy), len(radii)))
+    for k, radius in enumerate(radii):
+        near = pairs[pairs["v"] <= radius]
+        result[:, k] = np.bincount(near["i"], weights=weights[near["j"]], minlength=len(centres_xy))
+    return result
+
+
+def build_catchment_table(index: CatchmentIndex, radii=CATCHMENT_RADII) -> pd.DataFrame:
+    """
+    Taula compacta amb la població servida per cada estació d'estacions.csv i
+    cada parada proposada (L12, ampliació L1) als radis indicats.
+    """
+    df = load_stations()
+    _, station_lines = line_membership(df)
+    stations = df.groupby("NOM_ESTACIO")[["lon", "lat"]].first()
+    stations = pd.DataFrame({
+        "nom": stations.index,
+        "tipus": "existent",
+        "linies": [" ".join(station_lines.columns[row]) for row in station_lines.loc[stations.index].to_numpy()],
+        "lon": stations["lon"].to_numpy(),
+        "lat": stations["lat"].to_numpy(),
+    })
+
+    proposed = load_proposed_stops()
+    proposed = pd.DataFrame({
+        "nom": proposed["nom"],
+        "tipus": "proposta",
+        "linies": proposed["linia"],
+        "lon": proposed["lon"],
+        "lat": proposed["lat"],
+    })
+
+    table = pd.concat([stations, proposed], ignore_index=True)
+    x, y = index.project(table["lon"].to_numpy(), table["lat"].to_numpy())
+    points_xy, weights, _ = index.population.points()
+    population = population_within(np.column_stack([x, y]), points_xy, weights, radii)
+    for k, radius in enumerate(radii):
+        table[f"poblacio_{radius}"] = population[:, k].round().astype(int)
+    return table
+
+
+class CatchmentTable:
+    """Taula precalculada d'àrees d'influència (python catchment.py), recarregada si canvia."""
+
+    def __init__(self, path: str = CATCHMENTS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._records = None
+
+    @property
+    def available(self) -> bool:
+        return os.path.exists(self.path)
+
+    def records(self) -> list:
+        mtime = os.path.getmtime(self.path)
+        if self._records is not None and mtime == self._mtime:
+            return self._records
+        with self._lock:
+            if self._records is None or mtime != self._mtime:
+                table = pd.read_csv(self.path, keep_default_na=False)
+                self._records = table.to_dict(orient="records")
+                self._mtime = mtime
+            return self._records
+
+    def radii(self) -> list:
+        """Radis (m) de les columnes poblacio_* del fitxer, de menor a major."""
+        records = self.records()
+        if not records:
+            return []
+        return sorted(int(c.split("_", 1)[1]) for c in records[0] if c.startswith("poblacio_"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precalcula la població servida per estacions i parades proposades.")
+    parser.add_argument("--radis", type=int, nargs="+", default=list(CATCHMENT_RADII), help="radis en metres")
+    parser.add_argument("--output", default=CATCHMENTS_FILE, help="fitxer CSV de sortida")
+    args = parser.parse_args()
+
+    if cKDTree is None or gpd is None:
+        raise SystemExit("Cal instal·lar 'scipy', 'geopandas' i 'shapely' per precalcular les àrees d'influència.")
+
+    table = build_catchment_table(CatchmentIndex(), sorted(args.radis))
+    table.to_csv(args.output, index=False)
+    print(f"{len(table)} estacions i parades desades a {args.output}")
@@ -0,0 +1,150 @@
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+
+def normalize_message(text: str) -> str:
+    """Text en minúscules, sense accents, puntuació ni espais repetits."""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def ordered_mentions(text: str, names) -> tuple:
+    """
+    Noms de 'names' (ja normalitzats) que apareixen a 'text' en ordre d'aparició.
+    Si dos noms se solapen es queda el més llarg ("sagrada familia" i no "familia").
+    """
+    found = []
+    for name in names:
+        for m in re.finditer(rf"\b{re.escape(name)}\b", text):
+            found.append((m.start(), -len(name), name))
+
+    mentions, end = [], -1
+    for start, neg_len, name in sorted(found):
+        if start >= end:
+            mentions.append(name)
+            end = start - neg_len
+    return tuple(mentions)
+
+
+def char_ngrams(text: str, n: int = 3) -> Counter:
+    padded = f" {text} "
+    return Counter(padded[i:i + n] for i in range(max(len(padded) - n + 1, 1)))
+
+
+def tfidf_cosine(query: Counter, candidates: list) -> list:
+    """Similitud cosinus TF-IDF (n-grames de caràcters) de 'query' amb cada candidat."""
+    docs = [query, *candidates]
+    df = Counter(gram for doc in docs for gram in doc)
+    idf = {gram: math.log((1 + len(docs)) / (1 + count)) + 1.0 for gram, count in df.items()}
+
+    def weigh(doc):
+        vec = {gram: tf * idf[gram] for gram, tf in doc.items()}
+        norm = math.sqrt(sum(v * v for v in vec.values())) or 1.0
+        return vec, norm
+
+    q, q_norm = weigh(query)
+    scores = []
+    for doc in candidates:
+        vec, norm = weigh(doc)
+        dot = sum(w * vec.get(gram, 0.0) for gram, w in q.items())
+        scores.append(dot / (q_norm * norm))
+    return scores
+
+
+class ChatResponseCache:
+    """
+    Memòria cau de respostes del xatbot amb expiració (TTL) i LRU.
+
+    La clau és el missatge normalitzat més els últims torns de l'historial i
+    el mode de resposta (p. ex. amb eines o sense); tot es buida quan canvia la versió de les dades d'estacions.
+
+    Opcionalment, amb 'similarity' menor que 1 (p. ex. 0.92), una pregunta
+    gairebé igual (TF-IDF sobre n-grames de caràcters) amb el mateix historial
+    també aprofita la resposta. Com que els n-grames ignoren l'ordre, cal a més
+    que 'mentions(missatge)' (p. ex. les estacions citades, en ordre) coincideixi:
+    "de Sagrera a Catalunya" no reaprofita "de Catalunya a Sagrera".
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 3600.0, history_turns: int = 2,
+                 similarity: float = 1.0, mentions=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.history_turns = history_turns
+        self.similarity = similarity
+        self.mentions = mentions or (lambda message: ())
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, message: str, history=None, mode: str = "") -> tuple:
+        message = normalize_message(message)
+        history = list(history or [])
+        # El front pot enviar el missatge actual també com a últim torn de l'historial
+        if history and history[-1].get("role") == "user" and normalize_message(history[-1].get("content")) == message:
+            history.pop()
+
+        turns = []
+        for m in history[-self.history_turns:] if self.history_turns else []:
+            content = normalize_message(m.get("content"))
+            if m.get("role") in ("user", "assistant") and content:
+                turns.append((m["role"], content))
+        return tuple(turns), message, mode
+
+    def _check_version(self, version):
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key: tuple, version):
+        """Resposta en memòria cau per a 'key' i la versió de dades, o None."""
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            for k in [k for k, (expires, *_) in self._entries.items() if expires < now]:
+                del self._entries[k]
+
+            entry = self._entries.get(key)
+            if entry is None and self.similarity < 1.0 and key[1]:
+                entry, key = self._nearest(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def _nearest(self, key: tuple):
+        history, message, mode = key
+        mentions = self.mentions(message)
+        candidates = [(k, e) for k, e in self._entries.items()
+                      if k[0] == history and k[2] == mode and e[3] == mentions]
+        if not candidates:
+            return None, key
+        scores = tfidf_cosine(char_ngrams(message), [e[2] for _, e in candidates])
+        best = max(range(len(scores)), key=scores.__getitem__)
+        if scores[best] < self.similarity:
+            return None, key
+        return candidates[best][1], candidates[best][0]
+
+    def put(self, key: tuple, version, reply: str):
+        with self._lock:
+            self._check_version(version)
+            fuzzy = self.similarity < 1.0
+            self._entries[key] = (
+                time.monotonic() + self.ttl, reply,
+                char_ngrams(key[1]) if fuzzy else None,
+                self.mentions(key[1]) if fuzzy else None,
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,100 @@
+from propostes import load_proposed_stops
+from routing import data_files_version
+
+
+# Pressupost del resum de dades en tokens (aprox. 4 caràcters per token)
+CONTEXT_TOKEN_BUDGET = 700
+# Amb eines el model consulta les taules quan les necessita
+TOOLS_CONTEXT_TOKEN_BUDGET = 250
+CHARS_PER_TOKEN = 4
+
+# Instruccions fixes. Van primer i no canvien entre torns perquè el prefix del
+# prompt sigui idèntic i el servidor del model el pugui reaprofitar (prefix cache).
+SYSTEM_INSTRUCTIONS = (
+    "Ets l'assistent SmartMetro, especialitzat en el metro de Barcelona. "
+    "Respon sempre en català, amb un to proper, clar i precís.\n"
+    "- Basa't en les DADES de sota (estacions.csv del projecte SmartMetro).\n"
+    "- La L12 (Marina - UAB SAF, per Clot, Virrei Amat, La Sagrera, Cerdanyola i UAB Renfe) i l'ampliació "
+    "de la L1 cap a Badalona són propostes del projecte SmartMetro: explica'n la utilitat (connexió amb la UAB, "
+    "descongestionar L1 i L3, cobertura al Barcelonès Nord) deixant clar que són simulacions.\n"
+    "- No inventis horaris, freqüències ni temps de viatge; si no tens la dada, digues-ho.\n"
+)
+
+TOOLS_INSTRUCTIONS = (
+    "- Per a rànquings, estadístiques de línies, dades d'una estació o recorreguts fes servir les eines "
+    "disponibles en lloc de suposar-les.\n"
+    "- Sí que pots donar els temps de viatge estimats que et retornin les eines (recorregut), indicant que "
+    "són estimacions.\n"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def format_int(value) -> str:
+    return f"{int(round(value)):,}".replace(",", ".")
+
+
+def context_sections(data, rows: int, tables: bool = True) -> list:
+    """Seccions del resum amb com a molt 'rows' files per taula ('tables' False: sense taules)."""
+    dates = data.df["DATA"].dropna()
+    period = f"{dates.min():%Y-%m-%d} a {dates.max():%Y-%m-%d}" if len(dates) else "desconegut"
+
+    sections = [
+        "XARXA: {} estacions, {} línies ({}). Passatgers totals {} (període {}).".format(
+            data.num_estacions, data.num_linies, ", ".join(data.line_labels), format_int(data.total_passatgers), period
+        ),
+    ]
+    if tables:
+        sections += [
+            "ESTACIONS MÉS TRANSITADES: " + "; ".join(
+                f"{e['NOM_ESTACIO']} {format_int(e['total_persones'])}" for e in data.top_estacions[:rows]
+            ),
+            "LÍNIES (passatgers, parades): " + "; ".join(
+                f"{s['LINIA']} {format_int(s['total_persones'])}, {s['num_parades']}" for s in data.line_stats[:rows]
+            ),
+            "INTERCANVIADORS: " + "; ".join(
+                f"{ic['NOM_ESTACIO']} ({ic['linies']})" for ic in data.intercanviadors[:rows]
+            ),
+        ]
+
+    stops = load_proposed_stops()
+    for line, group in stops.groupby("linia", sort=False):
+        names = group["nom"].tolist()
+        # Sense noms (parades numerades) el traçat no aporta res al model
+        if all(n.startswith(f"{line} parada") for n in names):
+            continue
+        title = "L12 (proposta)" if line == "L12" else f"Ampliació {line} (proposta)"
+        sections.append(f"{title}: " + " - ".join(names[:rows * 2]))
+
+    return sections
+
+
+def build_context(data, budget: int = CONTEXT_TOKEN_BUDGET, tables: bool = True) -> str:
+    """
+    Resum de dades per al xatbot derivat dels agregats ja calculats. Si no
+    cap al pressupost de tokens, es redueixen les files de cada taula.
+    """
+    for rows in (10, 8, 6, 4, 3, 2, 1):
+        text = "DADES:\n" + "\n".join(context_sections(data, rows, tables))
+        if estimate_tokens(text) <= budget:
+            return text
+    return text[: budget * CHARS_PER_TOKEN]
+
+
+def system_prompt(data, tools: bool = False) -> str:
+    """
+    Prompt de sistema complet, idèntic per a tots els torns d'una mateixa
+    versió de dades. Amb 'tools' només porta el resum general de la xarxa.
+    """
+    if tools:
+        return data.cached(
+            ("chat_system_prompt_tools", data_files_version()),
+            lambda: SYSTEM_INSTRUCTIONS + TOOLS_INSTRUCTIONS + "\n"
+            + build_context(data, TOOLS_CONTEXT_TOKEN_BUDGET, tables=False),
+        )
+    return data.cached(
+        ("chat_system_prompt", data_files_version()),
+        lambda: SYSTEM_INSTRUCTIONS + "\n" + build_context(data),
+    )
@@ -0,0 +1,158 @@
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from chat_cache import normalize_message
+from chat_context import estimate_tokens
+
+
+# Pressupost de l'historial que s'envia al model (torns recents + resum)
+HISTORY_TOKEN_BUDGET = 1200
+SUMMARY_TOKEN_BUDGET = 200
+MAX_RECENT_TURNS = 8
+
+SUMMARY_HEADER = "RESUM DE LA CONVERSA ANTERIOR:"
+
+
+def first_sentence(text: str, max_chars: int) -> str:
+    """Primera frase del text, retallada a 'max_chars'."""
+    text = re.sub(r"\s+", " ", text).strip()
+    sentence = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+    if len(sentence) > max_chars:
+        sentence = sentence[: max_chars - 1].rstrip() + "…"
+    return sentence
+
+
+def summary_line(turn: dict) -> str:
+    """Línia extractiva del resum per a un torn que surt de la finestra."""
+    if turn["role"] == "user":
+        return "- Pregunta: " + first_sentence(turn["content"], 120)
+    return "  Resposta: " + first_sentence(turn["content"], 160)
+
+
+def clean_turns(history, message: str | None = None) -> list:
+    """
+    Torns user/assistant no buits. Es descarta l'últim si repeteix el missatge
+    actual, un torn idèntic a l'immediatament anterior i, si una pregunta es
+    repeteix, l'intercanvi antic sencer (pregunta i resposta), perquè els rols
+    continuïn alternant.
+    """
+    turns = []
+    for m in history or []:
+        role, content = m.get("role"), (m.get("content") or "").strip()
+        if role not in ("user", "assistant") or not content:
+            continue
+        if turns and turns[-1]["role"] == role \
+                and normalize_message(turns[-1]["content"]) == normalize_message(content):
+            continue
+        turns.append({"role": role, "content": content})
+
+    if message and turns and turns[-1]["role"] == "user" \
+            and normalize_message(turns[-1]["content"]) == normalize_message(message):
+        turns.pop()
+
+    # Intercanvis: una pregunta amb les respostes que la segueixen
+    exchanges = []
+    for turn in turns:
+        if turn["role"] == "user" or not exchanges:
+            exchanges.append([])
+        exchanges[-1].append(turn)
+
+    seen = set()
+    kept = []
+    for exchange in reversed(exchanges):
+        question = normalize_message(exchange[0]["content"]) if exchange[0]["role"] == "user" else None
+        if question is not None and question in seen:
+            continue
+        seen.add(question)
+        kept.append(exchange)
+    return [turn for exchange in reversed(kept) for turn in exchange]
+
+
+def compact_turns(turns: list, summary: list, history_budget: int = HISTORY_TOKEN_BUDGET,
+                  summary_budget: int = SUMMARY_TOKEN_BUDGET, max_turns: int = MAX_RECENT_TURNS):
+    """
+    Manté els torns recents dins del pressupost i resumeix els que en surten.
+    Retorna (torns, línies de resum); el resum perd primer les línies més antigues.
+    """
+    turns = list(turns)
+    summary = list(summary)
+    while turns and (len(turns) > max_turns
+                     or sum(estimate_tokens(t["content"]) for t in turns) > history_budget - summary_budget):
+        line = summary_line(turns.pop(0))
+        if line not in summary:
+            summary.append(line)
+
+    while summary and estimate_tokens("\n".join(summary)) > summary_budget:
+        summary.pop(0)
+    return turns, summary
+
+
+def summary_text(summary: list) -> str:
+    return SUMMARY_HEADER + "\n" + "\n".join(summary) if summary else ""
+
+
+class ChatSessionStore:
+    """
+    Historial de conversa al servidor per 'session_id' (LRU + expiració).
+
+    Cada sessió guarda els últims torns i un resum extractiu dels anteriors,
+    de manera que la mida del prompt es manté estable en converses llargues.
+    """
+
+    def __init__(self, max_sessions: int = 1000, ttl: float = 6 * 3600.0,
+                 history_budget: int = HISTORY_TOKEN_BUDGET, summary_budget: int = SUMMARY_TOKEN_BUDGET,
+                 max_turns: int = MAX_RECENT_TURNS):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.history_budget = history_budget
+        self.summary_budget = summary_budget
+        self.max_turns = max_turns
+
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # id -> (expira, torns, resum)
+
+    def compact(self, turns: list, summary: list = ()):
+        return compact_turns(turns, summary, self.history_budget, self.summary_budget, self.max_turns)
+
+    def load(self, session_id: str | None, history=None, message: str | None = None):
+        """
+        (session_id, torns, resum) de la sessió. Si no existeix (nova, expirada
+        o un identificador que no ha emès el servidor) se'n crea una amb un
+        identificador nou i l'historial que envia el client, ja compactat.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for k in [k for k, (expires, _, _) in self._sessions.items() if expires < now]:
+                del self._sessions[k]
+
+            entry = self._sessions.get(session_id) if session_id else None
+            if entry is None:
+                session_id = secrets.token_urlsafe(16)
+                turns, summary = self.compact(clean_turns(history, message))
+                entry = (now + self.ttl, turns, summary)
+                self._store(session_id, entry)
+
+            self._sessions.move_to_end(session_id)
+            return session_id, list(entry[1]), list(entry[2])
+
+    def append(self, session_id: str, message: str, reply: str):
+        """Afegeix el torn pregunta/resposta i compacta la sessió (si encara existeix)."""
+        with self._lock:
+            if session_id not in self._sessions:
+                return
+            _, turns, summary = self._sessions[session_id]
+            turns = clean_turns(turns + [
+                {"role": "user", "content": message},
+                {"role": "assistant", "content": reply},
+            ])
+            turns, summary = self.compact(turns, summary)
+            self._store(session_id, (time.monotonic() + self.ttl, turns, summary))
+
+    def _store(self, session_id: str, entry: tuple):
+        self._sessions[session_id] = entry
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
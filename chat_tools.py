@@ -0,0 +1,171 @@
+import json
+
+from routing import SCENARIOS, format_route, normalize_name, route_table
+
+
+# Definicions en format OpenAI (function calling) que s'envien al model
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "top_estacions",
+            "description": "Estacions amb més passatgers totals, ordenades de més a menys.",
+            "parameters": {
+                "type": "object",
+                "properties": {"n": {"type": "integer", "description": "Quantes estacions (1-20)", "default": 10}},
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "estadistiques_linies",
+            "description": "Passatgers totals, nombre de parades i mitjana per parada de cada línia de metro.",
+            "parameters": {
+                "type": "object",
+                "properties": {"linia": {"type": "string", "description": "Codi de línia (p. ex. L1). Buit: totes."}},
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "intercanviadors",
+            "description": "Estacions amb més d'una línia (intercanviadors), ordenades per passatgers.",
+            "parameters": {
+                "type": "object",
+                "properties": {"n": {"type": "integer", "description": "Quants intercanviadors (1-20)", "default": 10}},
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "info_estacio",
+            "description": "Línies, passatgers totals i mitjans diaris i coordenades d'una estació.",
+            "parameters": {
+                "type": "object",
+                "properties": {"nom": {"type": "string", "description": "Nom de l'estació"}},
+                "required": ["nom"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "recorregut",
+            "description": "Recorregut més ràpid en metro entre dues estacions (temps estimat, transbords i trams). "
+                           "'escenari' pot ser actual, l12, l1 o complet (amb les propostes SmartMetro).",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "origen": {"type": "string"},
+                    "desti": {"type": "string"},
+                    "escenari": {"type": "string", "enum": list(SCENARIOS), "default": "actual"},
+                },
+                "required": ["origen", "desti"],
+            },
+        },
+    },
+]
+
+
+def clamp(n, low: int = 1, high: int = 20) -> int:
+    try:
+        return max(low, min(high, int(n)))
+    except (TypeError, ValueError):
+        return 10
+
+
+def top_estacions(data, n=10):
+    return [
+        {"estacio": e["NOM_ESTACIO"], "passatgers": int(e["total_persones"])}
+        for e in data.top_estacions[:clamp(n)]
+    ]
+
+
+def estadistiques_linies(data, linia=None):
+    stats = data.line_stats
+    if linia:
+        stats = [s for s in stats if s["LINIA"].upper() == str(linia).strip().upper()]
+        if not stats:
+            return {"error": f"Línia desconeguda: {linia}"}
+    return [
+        {
+            "linia": s["LINIA"],
+            "passatgers": int(s["total_persones"]),
+            "parades": int(s["num_parades"]),
+            "mitjana_per_parada": round(float(s["mitjana_per_parada"]), 1),
+        }
+        for s in stats
+    ]
+
+
+def intercanviadors(data, n=10):
+    return [
+        {"estacio": ic["NOM_ESTACIO"], "linies": ic["linies"], "passatgers": int(ic["total_persones"])}
+        for ic in data.intercanviadors[:clamp(n)]
+    ]
+
+
+def info_estacio(data, nom):
+    names = {normalize_name(n): n for n in data.station_coords.index}
+    name = names.get(normalize_name(nom or ""))
+    if name is None or name not in data.station_lines.index:
+        return {"error": f"Estació desconeguda: {nom}"}
+
+    rows = data.df[data.df["NOM_ESTACIO"] == name]
+    lines = data.station_lines.columns[data.station_lines.loc[name].to_numpy()].tolist()
+    days = max(int(rows["DATA"].nunique()), 1)
+    lon, lat = data.station_coords.loc[name, ["lon", "lat"]].tolist()
+    return {
+        "estacio": name,
+        "linies": lines,
+        "passatgers_totals": int(rows["PERSONA"].sum()),
+        "passatgers_diaris_mitjans": round(float(rows["PERSONA"].sum()) / days, 1),
+        "lon": lon,
+        "lat": lat,
+    }
+
+
+def recorregut(data, origen, desti, escenari="actual"):
+    if escenari not in SCENARIOS:
+        return {"error": f"Escenari desconegut: {escenari}"}
+    table = route_table(data, escenari)
+    names = [table.resolve(origen or ""), table.resolve(desti or "")]
+    if None in names:
+        return {"error": f"Estació desconeguda: {origen if names[0] is None else desti}"}
+    route = table.route(*names)
+    if route is None:
+        return {"error": "No hi ha cap recorregut entre aquestes estacions"}
+    return {**route, "text": format_route(route)}
+
+
+TOOL_FUNCTIONS = {
+    "top_estacions": top_estacions,
+    "estadistiques_linies": estadistiques_linies,
+    "intercanviadors": intercanviadors,
+    "info_estacio": info_estacio,
+    "recorregut": recorregut,
+}
+
+
+def run_tool_call(data, call: dict) -> dict:
+    """Executa una crida d'eina del model i en retorna el missatge 'tool' amb el resultat."""
+    function = call.get("function") or {}
+    name = function.get("name")
+    try:
+        arguments = json.loads(function.get("arguments") or "{}")
+        if not isinstance(arguments, dict):
+            raise ValueError("els arguments han de ser un objecte")
+        func = TOOL_FUNCTIONS.get(name)
+        result = func(data, **arguments) if func else {"error": f"Eina desconeguda: {name}"}
+    except (TypeError, ValueError) as e:
+        result = {"error": f"Arguments no vàlids per a {name}: {e}"}
+
+    return {
+        "role": "tool",
+        "tool_call_id": call.get("id"),
+        "name": name,
+        "content": json.dumps(result, ensure_ascii=False),
+    }
@@ -1,16 +1,32 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 import uvicorn
 
-import pandas as pd
+import hashlib
 import os
+from contextlib import asynccontextmanager
+from datetime import date
 from dotenv import load_dotenv
+import orjson
+
+from analytics import AnalyticsEngine
+from tiles import BUILDINGS_LAYER, MBTilesArchive
+from population_grid import PopulationGrid
+from catchment import MAX_RADIUS, CatchmentIndex, CatchmentTable
+from routing import SCENARIOS, data_files_version, route_table, scenario_comparison
 
 # 🔹 Nou: dependències per al chatbot
-import requests
+import httpx
 from pydantic import BaseModel
+from publicai import (
+    PUBLICAI_BASE_URL, PUBLICAI_BURST, PUBLICAI_MODEL, PUBLICAI_REQUESTS_PER_MINUTE, PublicAIClient, PublicAIError,
+)
+from chat_cache import ChatResponseCache, normalize_message, ordered_mentions
+from chat_context import system_prompt as chat_system_prompt
+from chat_sessions import ChatSessionStore, summary_text
+from chat_tools import TOOLS as CHAT_TOOLS, run_tool_call
 
 load_dotenv()
 
@@ -24,111 +40,52 @@ PUBLICAI_API_KEY = os.getenv("PUBLICAI_API_KEY")
 if not PUBLICAI_API_KEY:
     print("ALERTA: No s'ha trobat PUBLICAI_API_KEY al .env. L'endpoint /chat no funcionarà.")
 
-PUBLICAI_BASE_URL = "https://api.publicai.co/v1/chat/completions"
-PUBLICAI_MODEL = "BSC-LT/salamandra-7b-instruct-tools-16k"
-
-app = FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
-
-START_LAT = 41.3874
-START_LON = 2.1686
-START_ZOOM = 12
-
-
-def process_data():
-    df = pd.read_csv("static/data/estacions.csv")
-
-    # Tipus
-    df["DATA"] = pd.to_datetime(df["DATA"], errors="coerce")
-    df["PERSONA"] = pd.to_numeric(df["PERSONA"], errors="coerce")
-    df["lon"] = pd.to_numeric(df["lon"], errors="coerce")
-    df["lat"] = pd.to_numeric(df["lat"], errors="coerce")
-
-    # Neteja mínima
-    df = df.dropna(subset=["NOM_ESTACIO", "PERSONA", "lon", "lat"]).reset_index(drop=True)
-
-    # Línies des de PICTO (L1, L3, L9S...)
-    df["PICTO"] = df["PICTO"].fillna("").astype(str)
-    df["LINIES"] = df["PICTO"].str.findall(r"L\d+S?")
-    df["LINIES"] = df["LINIES"].apply(lambda xs: xs if xs and len(xs) > 0 else [])
-
-    # Explosió línies per càlcul de mètriques
-    df_linies = df.explode("LINIES").rename(columns={"LINIES": "LINIA"})
-    df_linies = df_linies[df_linies["LINIA"].notna() & (df_linies["LINIA"] != "")]
-    df_linies = df_linies.reset_index(drop=True)
-
-    all_lines = sorted(df_linies["LINIA"].unique().tolist())
-
-    # Top 10 estacions per volum total
-    top_estacions = (
-        df.groupby("NOM_ESTACIO")
-        .agg(total_persones=("PERSONA", "sum"))
-        .sort_values("total_persones", ascending=False)
-        .head(10)
-        .reset_index()
-    )
-
-    # Intercanviadors: estacions amb més d'una línia
-    intercanviadors = (
-        df.groupby("NOM_ESTACIO")
-        .agg(
-            total_persones=("PERSONA", "sum"),
-            linies=("LINIES", lambda x: sorted(set(l for sub in x for l in sub)))
-        )
-        .reset_index()
+# Client amb connexions reutilitzades, concurrència limitada, reintents, peticions
+# idèntiques compartides i ritme limitat a la quota de la clau (0 = sense límit).
+# PUBLICAI_BASE_URL permet apuntar a un servidor compatible (p. ex. aina/mock_server.py)
+PUBLICAI = PublicAIClient(
+    PUBLICAI_API_KEY, os.getenv("PUBLICAI_BASE_URL", PUBLICAI_BASE_URL), PUBLICAI_MODEL,
+    requests_per_minute=float(os.getenv("PUBLICAI_REQUESTS_PER_MINUTE", PUBLICAI_REQUESTS_PER_MINUTE)) or None,
+    burst=int(os.getenv("PUBLICAI_BURST", PUBLICAI_BURST)),
+)
+
+def chat_station_mentions(message: str) -> tuple:
+    """Estacions citades al missatge normalitzat, en ordre (per a la coincidència aproximada)."""
+    data = ENGINE.snapshot()
+    names = data.cached(
+        "chat_station_names",
+        lambda: sorted({normalize_message(n) for n in data.station_coords.index} - {""}),
     )
+    return ordered_mentions(message, names)
 
-    intercanviadors["num_linies"] = intercanviadors["linies"].apply(len)
-    intercanviadors = intercanviadors[intercanviadors["num_linies"] > 1].copy()
-    intercanviadors["linies"] = intercanviadors["linies"].apply(lambda xs: ", ".join(xs))
-    intercanviadors = intercanviadors.sort_values("total_persones", ascending=False).reset_index(drop=True)
-
-    return df, df_linies, all_lines, top_estacions, intercanviadors
 
+# Respostes ja generades per a preguntes repetides (es buida si canvia estacions.csv).
+# Només coincidències exactes; similarity=0.92 activaria també les gairebé iguals.
+CHAT_CACHE = ChatResponseCache(mentions=chat_station_mentions)
 
-def compute_line_metrics(df_linies: pd.DataFrame) -> pd.DataFrame:
-    line_stats = (
-        df_linies
-        .groupby("LINIA")
-        .agg(
-            num_parades=("NOM_ESTACIO", "nunique"),
-            total_persones=("PERSONA", "sum"),
-        )
-        .reset_index()
-    )
-
-    line_stats["mitjana_per_parada"] = (
-        line_stats["total_persones"] / line_stats["num_parades"]
-    )
+# Historial de cada conversa al servidor, compactat a un pressupost de tokens
+CHAT_SESSIONS = ChatSessionStore()
 
-    return line_stats.sort_values("total_persones", ascending=False)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Tanca les connexions reutilitzades amb PublicAI en aturar el servidor
+    await PUBLICAI.aclose()
 
-# Pre-càlcul global
-DF, DF_LINIES, ALL_LINES, TOP_ESTACIONS_DF, INTERCANVIADORS_DF = process_data()
-LINE_STATS_DF = compute_line_metrics(DF_LINIES)
 
-# KPIs globals
-TOTAL_PASSATGERS = int(DF["PERSONA"].sum())
-MITJANA_PASSATGERS = float(DF["PERSONA"].mean())
-NUM_ESTACIONS = int(DF["NOM_ESTACIO"].nunique())
-NUM_LINIES = len(ALL_LINES)
+app = FastAPI(lifespan=lifespan)
+app.mount("/static", StaticFiles(directory="static"), name="static")
+templates = Jinja2Templates(directory="templates")
 
-# Per Jinja
-LINE_STATS = LINE_STATS_DF.to_dict(orient="records")
-TOP_ESTACIONS = TOP_ESTACIONS_DF.to_dict(orient="records")
-INTERCANVIADORS = INTERCANVIADORS_DF.to_dict(orient="records")
+START_LAT = 41.3874
+START_LON = 2.1686
+START_ZOOM = 12
 
-# Nou: CSV com a context per al chatbot
-# Si és molt gran, el limitem una mica per no rebentar tokens.
-CSV_FOR_BOT = DF.to_csv(index=False)
 
-# Opcional: si vols ser paranoic amb el límit de tokens:
-MAX_CHARS = 15000
-if len(CSV_FOR_BOT) > MAX_CHARS:
-    # Mostra totes les columnes però només una mostra d’estacions
-    CSV_FOR_BOT = DF.sample(n=min(len(DF), 200), random_state=42).to_csv(index=False)
+# Motor d'analítica: els agregats es calculen a la primera petició i es
+# reconstrueixen automàticament quan canvia estacions.csv.
+ENGINE = AnalyticsEngine(os.path.join("static", "data", "estacions.csv"))
 
 
 # =========================
@@ -163,156 +120,374 @@ def map_view(request: Request):
     )
 
 
+# Escenaris que es comparen amb la xarxa actual a /ampliacions
+AMPLIACIONS = {
+    "l1": "Ampliació de la L1",
+    "l12": "Nova L12",
+    "complet": "L12 i ampliació de la L1",
+}
+
+
 @app.get("/ampliacions")
 def ampliacions_view(request: Request):
+    data = ENGINE.snapshot()
+    comparisons = [
+        {"titol": title, **scenario_comparison(data, scenario)}
+        for scenario, title in AMPLIACIONS.items()
+    ]
+
     return templates.TemplateResponse(
         "ampliacions.html",
         {
             "request": request,
+            "comparisons": comparisons,
         },
     )
 
 
 @app.get("/dashboard", response_class=HTMLResponse)
 def dashboard_view(request: Request):
-    line_labels = [row["LINIA"] for row in LINE_STATS]
-    line_totals = [int(row["total_persones"]) for row in LINE_STATS]
+    data = ENGINE.snapshot()
 
     return templates.TemplateResponse(
         "dashboard.html",
         {
             "request": request,
-            "total_passatgers": TOTAL_PASSATGERS,
-            "mitjana_passatgers": MITJANA_PASSATGERS,
-            "num_estacions": NUM_ESTACIONS,
-            "num_linies": NUM_LINIES,
-            "line_stats": LINE_STATS,
-            "line_labels": line_labels,
-            "line_totals": line_totals,
-            "top_estacions": TOP_ESTACIONS,
-            "intercanviadors": INTERCANVIADORS,
+            "total_passatgers": data.total_passatgers,
+            "mitjana_passatgers": data.mitjana_passatgers,
+            "num_estacions": data.num_estacions,
+            "num_linies": data.num_linies,
+            "line_stats": data.line_stats,
+            "line_labels": data.line_labels,
+            "line_totals": data.line_totals,
+            "top_estacions": data.top_estacions,
+            "intercanviadors": data.intercanviadors,
+            "catchments": CATCHMENT_TABLE.records() if CATCHMENT_TABLE.available else [],
+            "catchment_radii": CATCHMENT_TABLE.radii() if CATCHMENT_TABLE.available else [],
         },
     )
 
 
 # =========================
-# 🔹 PART NOVA: CHATBOT
+# API DE DADES
 # =========================
 
-class ChatRequest(BaseModel):
-    message: str
-    history: list[dict] | None = None  # [{ "role": "user"/"assistant", "content": "..." }]
+# Cada bloc del dashboard com a JSON, serialitzat un sol cop per versió de dades
+DASHBOARD_PAYLOADS = {
+    "kpis": lambda d: {
+        "total_passatgers": d.total_passatgers,
+        "mitjana_passatgers": d.mitjana_passatgers,
+        "num_estacions": d.num_estacions,
+        "num_linies": d.num_linies,
+    },
+    "linies": lambda d: {
+        "line_stats": d.line_stats,
+        "line_labels": d.line_labels,
+        "line_totals": d.line_totals,
+    },
+    "top-estacions": lambda d: d.top_estacions,
+    "intercanviadors": lambda d: d.intercanviadors,
+}
+
+DASHBOARD_CACHE_CONTROL = "public, max-age=60, must-revalidate"
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Comprova la capçalera If-None-Match (accepta llistes, '*' i ETags febles)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [c.strip().removeprefix("W/") for c in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def cached_json_response(request: Request, data, name: str, builder) -> Response:
+    """
+    Resposta JSON amb el cos precalculat per a la versió de dades actual i un
+    ETag fort. Si el client ja té aquesta versió es respon un 304 sense cos.
+    """
+    def serialize():
+        body = orjson.dumps(builder(data), option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        return body, '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+    body, etag = data.cached(("json", name), serialize)
+    headers = {"ETag": etag, "Cache-Control": DASHBOARD_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
-def ask_salamandra(messages, max_tokens: int = 512, temperature: float = 0.7) -> str:
+@app.get("/api/population-grid")
+def population_grid_api(bbox: str, zoom: float = START_ZOOM):
     """
-    Envia els missatges directament al model Salamandra via PublicAI.
-    'messages' ha de ser una llista amb rols: system / user / assistant.
+    Població agregada per cel·les dins del viewport.
+    'bbox' = minlon,minlat,maxlon,maxlat; la mida de cel·la depèn del zoom.
     """
-    if not PUBLICAI_API_KEY:
-        return "Error de configuració: falta la PUBLICAI_API_KEY al servidor."
+    if not POPULATION_GRID.available:
+        raise HTTPException(status_code=404, detail="Graella de població no generada")
+    try:
+        coords = [float(v) for v in bbox.split(",")]
+    except ValueError:
+        coords = []
+    if len(coords) != 4 or coords[0] >= coords[2] or coords[1] >= coords[3]:
+        raise HTTPException(status_code=400, detail="bbox ha de ser minlon,minlat,maxlon,maxlat")
+    coords[1] = max(coords[1], -85.0)
+    coords[3] = min(coords[3], 85.0)
+    return POPULATION_GRID.query(coords, zoom)
+
+
+@app.get("/api/dashboard/{block}")
+def dashboard_api(block: str, request: Request):
+    """Blocs del dashboard en JSON: kpis, linies, top-estacions, intercanviadors."""
+    builder = DASHBOARD_PAYLOADS.get(block)
+    if builder is None:
+        raise HTTPException(status_code=404, detail=f"Bloc desconegut: {block}")
+    return cached_json_response(request, ENGINE.snapshot(), block, builder)
+
+
+@app.get("/api/ridership")
+def ridership_api(
+    start: date | None = Query(None, alias="from"),
+    end: date | None = Query(None, alias="to"),
+    granularity: str = "day",
+    station: list[str] | None = Query(None),
+    line: list[str] | None = Query(None),
+):
+    """
+    Passatgers per interval de dates i granularitat (day/week/month),
+    filtrables per estació i línia. Es respon des del cub precalculat.
+    Ex: /api/ridership?from=2025-01-01&to=2025-03-31&granularity=week&line=L1&line=L5
+    """
+    data = ENGINE.snapshot()
+    try:
+        return data.ridership.query(start, end, granularity, stations=station, lines=line)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    headers = {
-        "Authorization": f"Bearer {PUBLICAI_API_KEY}",
-        "Content-Type": "application/json",
-        "User-Agent": "UAB-THE-HACK/1.0",
-    }
 
-    payload = {
-        "model": PUBLICAI_MODEL,
-        "messages": messages,
-        "max_tokens": max_tokens,
-        "temperature": temperature,
-    }
+# Índex espacial de població i serveis per a les àrees d'influència
+CATCHMENT = CatchmentIndex()
 
-    try:
-        resp = requests.post(PUBLICAI_BASE_URL, headers=headers, json=payload, timeout=30)
 
-        if resp.status_code == 200:
-            data = resp.json()
-            return data["choices"][0]["message"]["content"]
+@app.get("/api/catchment")
+def catchment_api(station: str, radius: float = Query(500, gt=0, le=MAX_RADIUS)):
+    """
+    Població i serveis a menys de 'radius' metres d'una estació.
+    Ex: /api/catchment?station=Catalunya&radius=500
+    """
+    if not CATCHMENT.available:
+        raise HTTPException(status_code=404, detail="Punts de població no generats")
+    coords = ENGINE.snapshot().station_coords
+    if station not in coords.index:
+        raise HTTPException(status_code=404, detail=f"Estació desconeguda: {station}")
+
+    lon, lat = coords.loc[station, ["lon", "lat"]].tolist()
+    return {"estacio": station, "lon": lon, "lat": lat, **CATCHMENT.query(station, lon, lat, radius)}
+
+
+# Taula precalculada per a totes les estacions i parades proposades (python catchment.py)
+CATCHMENT_TABLE = CatchmentTable()
+
+
+@app.get("/api/catchments")
+def catchments_api():
+    """Població servida a 300/500/800 m per cada estació i parada proposada."""
+    if not CATCHMENT_TABLE.available:
+        raise HTTPException(status_code=404, detail="Taula d'àrees d'influència no generada")
+    return CATCHMENT_TABLE.records()
+
+
+@app.get("/api/route")
+def route_api(
+    origin: str = Query(..., alias="from"),
+    destination: str = Query(..., alias="to"),
+    scenario: str = "actual",
+):
+    """
+    Recorregut més ràpid entre dues estacions (temps, transbords i trams) a la
+    xarxa actual o amb les propostes: actual, l12, l1, complet.
+    Ex: /api/route?from=Catalunya&to=Sagrera&scenario=l12
+    """
+    if scenario not in SCENARIOS:
+        raise HTTPException(status_code=400, detail=f"Escenari desconegut: {scenario}")
+    table = route_table(ENGINE.snapshot(), scenario)
 
+    names = []
+    for name in (origin, destination):
+        resolved = table.resolve(name)
+        if resolved is None:
+            raise HTTPException(status_code=404, detail=f"Estació desconeguda: {name}")
+        names.append(resolved)
+
+    route = table.route(*names)
+    if route is None:
+        raise HTTPException(status_code=404, detail="No hi ha cap recorregut entre aquestes estacions")
+    return route
+
+
+@app.get("/api/ampliacions/{scenario}")
+def ampliacions_api(scenario: str, request: Request):
+    """
+    Temps de viatge de tots els parells d'estacions amb i sense l'ampliació,
+    ponderats per passatgers: minuts estalviats, parells i estacions que més hi guanyen.
+    """
+    if scenario not in SCENARIOS or scenario == "actual":
+        raise HTTPException(status_code=400, detail=f"Escenari desconegut: {scenario}")
+    name = ("ampliacio", scenario, data_files_version())
+    return cached_json_response(request, ENGINE.snapshot(), name, lambda d: scenario_comparison(d, scenario))
+
+
+# =========================
+# TESSEL·LES VECTORIALS
+# =========================
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+TILES_CACHE_CONTROL = "public, max-age=86400"
+
+# Arxiu amb totes les capes precuites (python tiles.py)
+TILE_ARCHIVE = MBTilesArchive()
+
+# Graelles de població agregada (python poblacion.py)
+POPULATION_GRID = PopulationGrid()
+
+
+def tile_response(data: bytes) -> Response:
+    # Tessel·la buida: 204 perquè MapLibre no ho tracti com un error
+    if not data:
+        return Response(status_code=204, headers={"Cache-Control": TILES_CACHE_CONTROL})
+    return Response(content=data, media_type=MVT_MEDIA_TYPE, headers={"Cache-Control": TILES_CACHE_CONTROL})
+
+
+@app.get("/tiles/buildings/{z}/{x}/{y}.pbf")
+def buildings_tile(z: int, x: int, y: int):
+    """Edificis en format Mapbox Vector Tile, tallats des de buildings.geojson."""
+    if not (0 <= z <= BUILDINGS_LAYER.max_zoom and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        raise HTTPException(status_code=404, detail="Tessel·la fora de rang")
+    if not BUILDINGS_LAYER.available:
+        raise HTTPException(status_code=404, detail="Capa d'edificis no disponible")
+    return tile_response(BUILDINGS_LAYER.tile(z, x, y))
+
+
+@app.get("/tiles/smartmetro.json")
+def tile_archive_tilejson(request: Request):
+    """TileJSON de l'arxiu MBTiles; 404 si encara no s'ha generat."""
+    if not TILE_ARCHIVE.available:
+        raise HTTPException(status_code=404, detail="Arxiu de tessel·les no generat")
+    tiles_url = str(request.base_url).rstrip("/") + "/tiles/{z}/{x}/{y}.pbf"
+    return TILE_ARCHIVE.tilejson(tiles_url)
+
+
+@app.get("/tiles/{z}/{x}/{y}.pbf")
+def tile_archive_tile(z: int, x: int, y: int):
+    """Tessel·la de l'arxiu MBTiles, servida tal qual (ja comprimida amb gzip)."""
+    if not TILE_ARCHIVE.available:
+        raise HTTPException(status_code=404, detail="Arxiu de tessel·les no generat")
+    if not (0 <= z <= 24 and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        raise HTTPException(status_code=404, detail="Tessel·la fora de rang")
+
+    data = TILE_ARCHIVE.tile(z, x, y)
+    if data is None:
+        return Response(status_code=204, headers={"Cache-Control": TILES_CACHE_CONTROL})
+    return Response(
+        content=data,
+        media_type=MVT_MEDIA_TYPE,
+        headers={"Content-Encoding": "gzip", "Cache-Control": TILES_CACHE_CONTROL},
+    )
+
+
+# =========================
+# 🔹 PART NOVA: CHATBOT
+# =========================
+
+class ChatRequest(BaseModel):
+    message: str
+    history: list[dict] | None = None  # [{ "role": "user"/"assistant", "content": "..." }]
+    session_id: str | None = None  # si el servidor ja coneix la sessió, s'ignora 'history'
+
+
+def publicai_error_message(e: Exception) -> str:
+    """Missatge per a l'usuari a partir d'un error de PublicAI."""
+    if isinstance(e, PublicAIError):
         # Debug útil al terminal
-        print("PublicAI ERROR:", resp.status_code, resp.text)
+        print("PublicAI ERROR:", e.status_code, e.text)
 
-        if resp.status_code == 401:
+        if e.status_code == 401:
             return "❌ Error: API key invàlida o no autoritzada."
-        if resp.status_code == 429:
+        if e.status_code == 429:
             return "⚠️ Límit d'ús assolit per aquesta API key. Redueix peticions o fes servir una clau diferent."
-        return f"❌ Error {resp.status_code}: {resp.text[:200]}"
+        return f"❌ Error {e.status_code}: {e.text[:200]}"
 
-    except requests.exceptions.Timeout:
+    if isinstance(e, httpx.TimeoutException):
         return "⏱️ Timeout: el model triga massa a respondre."
+    print("Error amb PublicAI:", e)
+    return "Hi ha hagut un error en comunicar amb el model."
+
+
+MISSING_KEY_MESSAGE = "Error de configuració: falta la PUBLICAI_API_KEY al servidor."
+EMPTY_REPLY_MESSAGE = "No he pogut generar una resposta. Torna-ho a provar reformulant la pregunta."
+
+# Rondes màximes de crides a eines abans de demanar la resposta final
+MAX_TOOL_ROUNDS = 3
+
+
+async def ask_salamandra(messages, max_tokens: int = 512, temperature: float = 0.7, cache_key=None,
+                         tools: bool = False, session=None) -> str:
+    """
+    Envia els missatges directament al model Salamandra via PublicAI.
+    'messages' ha de ser una llista amb rols: system / user / assistant.
+    Amb 'cache_key' es reaprofiten (i es desen) les respostes correctes.
+    Amb 'tools' el model pot consultar les dades amb les eines de chat_tools,
+    que s'executen aquí mateix sobre la versió actual de les dades.
+    Amb 'session' = (session_id, missatge) la resposta s'afegeix a la sessió.
+    """
+    data = ENGINE.snapshot()
+    version = data.version
+    if cache_key is not None:
+        cached = CHAT_CACHE.get(cache_key, version)
+        if cached is not None:
+            if session is not None:
+                CHAT_SESSIONS.append(*session, cached)
+            return cached
+
+    if not PUBLICAI_API_KEY:
+        return MISSING_KEY_MESSAGE
+
+    try:
+        if tools:
+            reply = await PUBLICAI.complete_with_tools(
+                messages, CHAT_TOOLS, lambda call: run_tool_call(data, call),
+                MAX_TOOL_ROUNDS, max_tokens, temperature,
+            )
+        else:
+            reply = await PUBLICAI.complete(messages, max_tokens, temperature)
     except Exception as e:
-        print("Error amb PublicAI:", e)
-        return "Hi ha hagut un error en comunicar amb el model."
+        return publicai_error_message(e)
 
-@app.post("/chat")
-def chat_endpoint(req: ChatRequest):
+    # Una resposta buida no es desa ni a la memòria cau ni a la sessió
+    if not reply or not reply.strip():
+        return EMPTY_REPLY_MESSAGE
+
+    if cache_key is not None:
+        CHAT_CACHE.put(cache_key, version, reply)
+    if session is not None:
+        CHAT_SESSIONS.append(*session, reply)
+    return reply
+
+
+def build_chat_messages(req: ChatRequest, tools: bool = False):
     """
-    Endpoint REST perquè el front demani respostes del chatbot.
-    Construeix un 'messages' vàlid per PublicAI:
-    - Primer 'system' amb el CSV
-    - Historial alternant rols (user/assistant), fusionant consecutius
+    Construeix un 'messages' vàlid per PublicAI i retorna (session_id, cache_key, messages):
+    - Primer 'system' amb les instruccions, el resum de dades (més curt amb 'tools')
+      i, si n'hi ha, el resum dels torns antics de la sessió
+    - Historial recent de la sessió alternant rols (user/assistant), fusionant consecutius
     - Finalment el missatge actual com a 'user' (fusionat si cal)
     """
+    session_id, turns, summary = CHAT_SESSIONS.load(req.session_id, req.history, req.message)
 
-    system_prompt = (
-        "Ets l'assistent SmartMetro, un xatbot especialitzat en la xarxa de metro de Barcelona. "
-        "Respon SEMPRE en català i en llenguatge natural, amb un to clar, entenedor i informatiu.\n\n"
-        " DADES I CONTEXT DISPONIBLES:\n"
-        "1️ Xarxa actual de metro de Barcelona (provinent del fitxer estacions.csv del projecte SmartMetro):\n"
-        "- Cada estació conté: NOM_ESTACIO, DATA, PERSONA (nombre de passatgers registrats), PICTO (línies associades), "
-        "i coordenades lon/lat.\n"
-        "- Pots deduir quines són les estacions més transitades, els principals intercanviadors i el volum de persones per línia.\n"
-        "- Les línies actuals inclouen: L1, L2, L3, L4, L5, L9S, L10S, entre altres.\n\n"
-        "2️ Nova Línia 12 (fitxer actualitzat 'L12.geojson'):\n"
-        "- Representa una línia de metro **projectada pel projecte SmartMetro**, anomenada 'Línia 12' o 'L12'.\n"
-        "- El recorregut real proposat comença a l’estació **Marina** (enllaç amb L1) i avança cap a **El Clot**, "
-        "segueix per **Virrei Amat** i **La Sagrera**, travessa cap a **Cerdanyola**, i finalitza a la Universitat Autònoma de Barcelona, "
-        "amb dues estacions universitàries: **UAB Renfe** i **UAB SAF**.\n"
-        "- Té un paper estratègic, ja que connecta el centre de Barcelona amb el campus universitari de la UAB "
-        "i amb la zona nord metropolitana, millorant la connexió directa entre zones residencials i educatives.\n"
-        "- Enllaços clau amb altres línies:\n"
-        "   · L1 a Marina\n"
-        "   · L2 i L5 a El Clot\n"
-        "   · L5 i L9 a La Sagrera\n"
-        "   · Rodalies a Cerdanyola i UAB Renfe\n"
-        "- Objectius principals:\n"
-        "   · Oferir un eix de connexió directe entre Barcelona i la UAB.\n"
-        "   · Descongestionar línies centrals (L1 i L3).\n"
-        "   · Reduir temps de desplaçament entre la ciutat i el campus.\n"
-        "   · Potenciar l’ús del transport públic per a estudiants i treballadors de la UAB.\n\n"
-        "3️ Ampliació de la L1 cap a Badalona (fitxer 'ampliacio_l1.geojson'):\n"
-        "- Aquesta ampliació allarga la L1 des del seu tram final a **Fondo** fins a noves estacions dins del municipi de **Badalona**.\n"
-        "- El traçat projectat va aproximadament des de lon 2.2209, lat 41.4524 fins a lon 2.2585, lat 41.4546.\n"
-        "- Objectius:\n"
-        "   · Millorar la cobertura territorial al Barcelonès Nord.\n"
-        "   · Afavorir la connexió amb altres línies (L2, L9 Nord) i nous intercanviadors.\n"
-        "   · Reduir la dependència de trajectes per carretera i millorar l’accessibilitat de la població de Badalona.\n\n"
-        " OBJECTIU DE L’ASSISTENT:\n"
-        "- Ajudar l’usuari a comprendre i explorar la xarxa de metro de Barcelona combinant:\n"
-        "  · La xarxa actual (segons les dades del CSV d’estacions i línies).\n"
-        "  · La línia dissenyada L12 (de Marina a UAB SAF).\n"
-        "  · L’ampliació de la L1 cap a Badalona.\n"
-        "- Millorar l’experiència d’usuari i l’accessibilitat a la informació, responent preguntes com:\n"
-        "  · Quina és l’estació més transitada?\n"
-        "  · On hi ha intercanviadors?\n"
-        "  · Quina línia transporta més passatgers?\n"
-        "  · Quines noves connexions aporta la L12?\n"
-        "  · Com beneficia la L1 ampliada la zona de Badalona?\n"
-        "  · Quin recorregut permet arribar a la UAB amb metro?\n\n"
-        " INSTRUCCIONS DE COMPORTAMENT:\n"
-        "- Respon sempre en català i amb un to proper però precís.\n"
-        "- Basat en les dades, pots parlar d’estacions, línies i ampliacions del projecte.\n"
-        "- Quan parlis de la L12 o l’ampliació de la L1, recorda que són **propostes del projecte SmartMetro**: "
-        "descriu-ne la seva utilitat i impacte positiu sobre la mobilitat.\n"
-        "- No inventis dades concretes (horaris, freqüències, temps de viatge) si no existeixen. "
-        "Si l’usuari pregunta per informació inexistent, indica-ho amb claredat i dona una resposta conceptual o qualitativa.\n"
-        "- Si l’usuari demana com arribar d’un punt a un altre, pots descriure un recorregut orientatiu fent servir les línies existents "
-        "i la L12 o l’ampliació de la L1, especificant que és una simulació basada en el model SmartMetro.\n"
-    )
-
+    # Instruccions curtes + resum de dades per versió (sempre el mateix prefix)
+    system_prompt = chat_system_prompt(ENGINE.snapshot(), tools)
+    if summary:
+        system_prompt += "\n\n" + summary_text(summary)
 
     messages = [
         {"role": "system", "content": system_prompt}
@@ -320,20 +495,14 @@ def chat_endpoint(req: ChatRequest):
 
     last_role = "system"
 
-    # 1) Netegem i afegim historial, garantint que no hi ha rols consecutius iguals
-    if req.history:
-        for m in req.history:
-            role = m.get("role")
-            content = (m.get("content") or "").strip()
-            if role not in ("user", "assistant") or not content:
-                continue
-
-            if role == last_role:
-                # Si hi ha dos del mateix rol seguits, els unim
-                messages[-1]["content"] += "\n" + content
-            else:
-                messages.append({"role": role, "content": content})
-                last_role = role
+    # 1) Afegim l'historial (ja net i dins del pressupost), sense rols consecutius iguals
+    for m in turns:
+        if m["role"] == last_role:
+            # Si hi ha dos del mateix rol seguits, els unim
+            messages[-1]["content"] += "\n" + m["content"]
+        else:
+            messages.append(dict(m))
+            last_role = m["role"]
 
     # 2) Afegim el missatge actual com a 'user'
     new_content = (req.message or "").strip()
@@ -344,8 +513,65 @@ def chat_endpoint(req: ChatRequest):
         else:
             messages.append({"role": "user", "content": new_content})
 
-    reply = ask_salamandra(messages)
-    return {"reply": reply}
+    # Les respostes amb eines i sense no es barregen a la memòria cau
+    return session_id, CHAT_CACHE.key(req.message, turns, "eines" if tools else ""), messages
+
+
+@app.post("/chat")
+async def chat_endpoint(req: ChatRequest):
+    """Endpoint REST perquè el front demani respostes del chatbot (amb eines sobre les dades)."""
+    session_id, cache_key, messages = build_chat_messages(req, tools=True)
+    reply = await ask_salamandra(messages, cache_key=cache_key, tools=True, session=(session_id, req.message))
+    return {"reply": reply, "session_id": session_id}
+
+
+def sse_event(data) -> str:
+    return "data: " + orjson.dumps(data).decode() + "\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(req: ChatRequest):
+    """
+    Com /chat però en Server-Sent Events: cada fragment del model s'envia
+    tan bon punt arriba com a {"delta": "..."}; els errors com a {"error": "..."}
+    i el final amb 'data: [DONE]'. L'identificador de sessió va a la capçalera X-Session-Id.
+    Les rondes d'eines es fan abans i només s'envia en streaming la resposta final.
+    """
+    session_id, cache_key, messages = build_chat_messages(req, tools=True)
+    data = ENGINE.snapshot()
+    version = data.version
+
+    async def events():
+        cached = CHAT_CACHE.get(cache_key, version)
+        if cached is not None:
+            CHAT_SESSIONS.append(session_id, req.message, cached)
+            yield sse_event({"delta": cached})
+        elif not PUBLICAI_API_KEY:
+            yield sse_event({"error": MISSING_KEY_MESSAGE})
+        else:
+            parts = []
+            try:
+                async for delta in PUBLICAI.stream_with_tools(
+                    messages, CHAT_TOOLS, lambda call: run_tool_call(data, call), MAX_TOOL_ROUNDS,
+                ):
+                    parts.append(delta)
+                    yield sse_event({"delta": delta})
+            except Exception as e:
+                yield sse_event({"error": publicai_error_message(e)})
+            else:
+                reply = "".join(parts)
+                if reply.strip():
+                    CHAT_CACHE.put(cache_key, version, reply)
+                    CHAT_SESSIONS.append(session_id, req.message, reply)
+                else:
+                    yield sse_event({"error": EMPTY_REPLY_MESSAGE})
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Session-Id": session_id},
+    )
 
 
 if __name__ == "__main__":
@@ -1,6 +1,10 @@
+import argparse
+import hashlib
+import json
 import geopandas as gpd
 import pandas as pd
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 # --- Configuración ---
 
@@ -21,6 +25,20 @@ files_to_merge = [
 # 3. Nombre del archivo de salida
 OUTPUT_FILE = os.path.join(DATA_DIR, "buildings.geojson")
 
+# 4. Columna con la referencia catastral (para quitar duplicados entre municipios)
+REFERENCE_COLUMN = "reference"
+
+# 5. Formatos de salida disponibles (mismo nombre base que OUTPUT_FILE)
+OUTPUT_FORMATS = {
+    "geojson": ".geojson",
+    "parquet": ".parquet",
+    "fgb": ".fgb",
+}
+
+# 6. Particiones por municipio y manifiesto de hashes (modo incremental)
+PARTS_DIR = os.path.join(DATA_DIR, "buildings_parts")
+MANIFEST_FILE = os.path.join(PARTS_DIR, "manifest.json")
+
 # ---------------------
 
 def merge_geojson_files():
@@ -81,6 +99,233 @@ def merge_geojson_files():
     except Exception as e:
         print(f"ERROR: No se pudo guardar el archivo combinado. Error: {e}")
 
+def leer_y_reproyectar(filepath, target_crs):
+    """Lee un archivo y lo reproyecta al CRS objetivo (se ejecuta en un proceso aparte)."""
+    current_gdf = gpd.read_file(filepath)
+    if target_crs is not None and current_gdf.crs != target_crs:
+        current_gdf = current_gdf.to_crs(target_crs)
+    return current_gdf
+
+
+def deduplicar_edificios(gdf, columna=REFERENCE_COLUMN):
+    """
+    Quita los edificios repetidos en la frontera entre municipios: misma
+    referencia catastral en varios archivos. Se queda con el primero.
+    """
+    if columna not in gdf.columns:
+        print(f"Aviso: no existe la columna '{columna}', no se deduplica.")
+        return gdf
+    ref = gdf[columna]
+    duplicados = ref.notna() & ref.duplicated(keep="first")
+    print(f" -> Edificios duplicados eliminados: {int(duplicados.sum())}")
+    return gdf[~duplicados].reset_index(drop=True)
+
+
+def guardar_formatos(gdf, formatos, output_file=OUTPUT_FILE):
+    """Guarda el resultado en cada formato pedido (GeoJSON, GeoParquet, FlatGeobuf)."""
+    base = os.path.splitext(output_file)[0]
+    for formato in formatos:
+        path = base + OUTPUT_FORMATS[formato]
+        try:
+            print(f"Guardando {formato}: {path}")
+            if formato == "parquet":
+                gdf.to_parquet(path)
+            elif formato == "fgb":
+                gdf.to_file(path, driver="FlatGeobuf")
+            else:
+                gdf.to_file(path, driver="GeoJSON")
+        except Exception as e:
+            print(f"ERROR: No se pudo guardar {path}. Error: {e}")
+
+
+def merge_geojson_files_paralelo(workers=None, formatos=("geojson", "parquet"), deduplicar=True):
+    """
+    Igual que 'merge_geojson_files' pero leyendo y reproyectando cada archivo
+    en un proceso distinto, quitando duplicados por referencia catastral y
+    guardando también en formatos columnares.
+    """
+    print("Iniciando la unión de archivos GeoJSON (en paralelo)...")
+
+    filepaths = []
+    for filename in files_to_merge:
+        filepath = os.path.join(DATA_DIR, filename)
+        if os.path.exists(filepath):
+            filepaths.append(filepath)
+        else:
+            print(f"ERROR: No existe el archivo {filepath}. Saltando.")
+
+    if not filepaths:
+        print("No se ha podido leer ningún archivo. Saliendo.")
+        return
+
+    # El CRS objetivo es el del primer archivo (se lee solo la cabecera)
+    target_crs = gpd.read_file(filepaths[0], rows=1).crs
+    print(f" -> CRS objetivo establecido a: {target_crs.to_string() if target_crs else None}")
+
+    gdfs_list = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(fp, pool.submit(leer_y_reproyectar, fp, target_crs)) for fp in filepaths]
+        # Se recogen en el orden de 'files_to_merge' para que el resultado sea estable
+        for filepath, future in futures:
+            try:
+                current_gdf = future.result()
+                print(f"Leído: {filepath} -> {len(current_gdf)} edificios.")
+                gdfs_list.append(current_gdf)
+            except Exception as e:
+                print(f"ERROR: No se pudo leer el archivo {filepath}. Error: {e}")
+                print(" -> Saltando este archivo.")
+
+    if not gdfs_list:
+        print("No se ha podido leer ningún archivo. Saliendo.")
+        return
+
+    print("\nCombinando todos los archivos...")
+    combined_gdf = pd.concat(gdfs_list, ignore_index=True)
+    if deduplicar:
+        combined_gdf = deduplicar_edificios(combined_gdf)
+
+    guardar_formatos(combined_gdf, formatos)
+    print("\n--- ¡Éxito! ---")
+    print(f"Total de edificios combinados: {len(combined_gdf)}")
+
+
+def hash_archivo(path, chunk_size=1 << 20):
+    """SHA-256 del contenido del archivo."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cargar_manifest(path=MANIFEST_FILE):
+    """Manifiesto de la última unión incremental ({} si no existe)."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def reproyectar_particion(filepath, target_crs, partition_path):
+    """Lee, reproyecta y guarda la partición de un municipio. Devuelve el n.º de edificios."""
+    current_gdf = leer_y_reproyectar(filepath, target_crs)
+    current_gdf.to_parquet(partition_path)
+    return len(current_gdf)
+
+
+def merge_incremental(workers=None, formatos=("geojson", "parquet"), deduplicar=True):
+    """
+    Unión incremental: cada municipio se guarda reproyectado como partición
+    GeoParquet y el manifiesto recuerda el SHA-256 de su archivo de origen.
+    Solo se vuelven a leer y reproyectar los archivos cuyo hash ha cambiado;
+    el resto se toma directamente de su partición.
+    """
+    print("Iniciando la unión incremental de archivos GeoJSON...")
+    os.makedirs(PARTS_DIR, exist_ok=True)
+
+    filepaths = {}
+    for filename in files_to_merge:
+        filepath = os.path.join(DATA_DIR, filename)
+        if os.path.exists(filepath):
+            filepaths[filename] = filepath
+        else:
+            print(f"ERROR: No existe el archivo {filepath}. Saltando.")
+
+    if not filepaths:
+        print("No se ha podido leer ningún archivo. Saliendo.")
+        return
+
+    manifest = cargar_manifest()
+    anteriores = manifest.get("files", {})
+
+    # El CRS objetivo es el del primer archivo; si cambia, hay que rehacerlo todo
+    target_crs = gpd.read_file(next(iter(filepaths.values())), rows=1).crs
+    target_crs_str = target_crs.to_string() if target_crs else None
+    if manifest.get("target_crs") != target_crs_str:
+        anteriores = {}
+    print(f" -> CRS objetivo establecido a: {target_crs_str}")
+
+    entradas = {}
+    pendientes = []
+    for filename, filepath in filepaths.items():
+        sha = hash_archivo(filepath)
+        partition = os.path.splitext(filename)[0] + ".parquet"
+        anterior = anteriores.get(filename)
+        if anterior and anterior["sha256"] == sha and os.path.exists(os.path.join(PARTS_DIR, partition)):
+            print(f"Sin cambios: {filename}")
+            entradas[filename] = anterior
+        else:
+            entradas[filename] = {"sha256": sha, "partition": partition, "rows": None}
+            pendientes.append(filename)
+
+    eliminados = set(anteriores) - set(entradas)
+    for filename in eliminados:
+        print(f"Eliminada la partición de: {filename}")
+        path = os.path.join(PARTS_DIR, anteriores[filename]["partition"])
+        if os.path.exists(path):
+            os.remove(path)
+
+    base = os.path.splitext(OUTPUT_FILE)[0]
+    salidas_ok = all(os.path.exists(base + OUTPUT_FORMATS[f]) for f in formatos)
+    if not pendientes and not eliminados and salidas_ok:
+        print("\nNingún archivo ha cambiado. Nada que hacer.")
+        return
+
+    if pendientes:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                (filename, pool.submit(reproyectar_particion, filepaths[filename], target_crs,
+                                       os.path.join(PARTS_DIR, entradas[filename]["partition"])))
+                for filename in pendientes
+            ]
+            for filename, future in futures:
+                try:
+                    entradas[filename]["rows"] = future.result()
+                    print(f"Reprocesado: {filename} -> {entradas[filename]['rows']} edificios.")
+                except Exception as e:
+                    print(f"ERROR: No se pudo leer el archivo {filepaths[filename]}. Error: {e}")
+                    print(" -> Saltando este archivo.")
+                    del entradas[filename]
+
+    if not entradas:
+        print("No se ha podido leer ningún archivo. Saliendo.")
+        return
+
+    # Se combinan en el orden de 'files_to_merge' para que el resultado sea estable
+    print("\nCombinando todas las particiones...")
+    combined_gdf = pd.concat(
+        [gpd.read_parquet(os.path.join(PARTS_DIR, e["partition"])) for e in entradas.values()],
+        ignore_index=True,
+    )
+    if deduplicar:
+        combined_gdf = deduplicar_edificios(combined_gdf)
+
+    guardar_formatos(combined_gdf, formatos)
+
+    with open(MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump({"target_crs": target_crs_str, "files": entradas}, f, indent=2)
+
+    print("\n--- ¡Éxito! ---")
+    print(f"Archivos reprocesados: {len(pendientes)} de {len(entradas)}")
+    print(f"Total de edificios combinados: {len(combined_gdf)}")
+
+
 # --- Ejecutar el script ---
 if __name__ == "__main__":
-    merge_geojson_files()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Une los edificios de varios municipios.")
+    parser.add_argument("--paralelo", action="store_true",
+                        help="lee y reproyecta en paralelo, deduplica y guarda en varios formatos")
+    parser.add_argument("--incremental", action="store_true",
+                        help="como --paralelo, pero solo reprocesa los municipios cuyo archivo ha cambiado")
+    parser.add_argument("--workers", type=int, default=None, help="procesos para los modos paralelo e incremental")
+    parser.add_argument("--formatos", nargs="+", choices=sorted(OUTPUT_FORMATS), default=["geojson", "parquet"],
+                        help="formatos de salida de los modos paralelo e incremental")
+    parser.add_argument("--sin-dedup", action="store_true", help="no quitar duplicados por referencia catastral")
+    args = parser.parse_args()
+
+    if args.incremental:
+        merge_incremental(args.workers, args.formatos, deduplicar=not args.sin_dedup)
+    elif args.paralelo:
+        merge_geojson_files_paralelo(args.workers, args.formatos, deduplicar=not args.sin_dedup)
+    else:
+        merge_geojson_files()
\ No newline at end of file
@@ -1,3 +1,4 @@
+import argparse
 import json
 import os
 try:
@@ -8,130 +9,527 @@ except ImportError:
     print("Por favor, instálala ejecutando: pip install shapely")
     exit()
 
+try:
+    # Opcional: lectura incremental del GeoJSON (modo streaming)
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    # Opcional: cálculo vectorizado (modo vectorial)
+    import geopandas as gpd
+    import numpy as np
+    import pandas as pd
+    import shapely
+except ImportError:
+    gpd = None
+
+from population_grid import GridAccumulator, POPULATION_GRID_FILE
+
 # --- 1. Configuración ---
 input_file = os.path.join("static", "data", "buildings.geojson")
 output_file = os.path.join("static", "data", "population_points.geojson")
+grid_file = POPULATION_GRID_FILE
+
+# Particiones de puntos por municipio (modo incremental)
+POPULATION_PARTS_DIR = os.path.join("static", "data", "population_parts")
+POPULATION_MANIFEST_FILE = os.path.join(POPULATION_PARTS_DIR, "manifest.json")
 
 # Población de Barcelona (Municipio) para 2024, según Idescat.
 POBLACION_BARCELONA = 2330000
 
-print(f"Iniciando análisis de población (con salida de PUNTOS).")
-print(f"Archivo de entrada: {input_file}")
-print(f"Archivo de salida: {output_file}")
-print(f"Población total de Barcelona (2024): {POBLACION_BARCELONA}")
+OUTPUT_NAME = "barcelona_population_points"
 
-try:
+
+def limpiar_viviendas(raw_dwellings):
+    """N.º de viviendas como entero (puede venir como None, str, int o float)."""
+    if isinstance(raw_dwellings, (int, float)):
+        return int(raw_dwellings)
+    if isinstance(raw_dwellings, str):
+        try:
+            return int(raw_dwellings)
+        except (ValueError, TypeError):
+            return 0
+    return 0
+
+
+def es_residencial(feature):
+    return (feature.get('properties') or {}).get('currentUse') == '1_residential'
+
+
+def crear_punto(feature, dwellings_clean, habitantes_por_vivienda):
+    """
+    Feature final: punto representativo del edificio con las propiedades
+    filtradas. Lanza una excepción si la geometría no es válida.
+    """
+    estimated_pop = dwellings_clean * habitantes_por_vivienda
+    original_geom = shape(feature['geometry'])
+    centroid_point = original_geom.representative_point()
+
+    old_props = feature.get('properties', {})
+    new_props = {
+        # Mapeamos los nombres originales a los que pediste
+        "referencia_catastral": old_props.get('reference'),
+        "metros_cuadrados": old_props.get('value'),
+        "viviendas": dwellings_clean,
+        "poblacion_estimada": estimated_pop
+    }
+
+    return {
+        "type": "Feature",
+        "geometry": mapping(centroid_point), # Geometría de punto
+        "properties": new_props              # Solo las propiedades filtradas
+    }
+
+
+class EscritorGeoJSON:
+    """
+    Escribe una FeatureCollection feature a feature en formato compacto,
+    sin tener que mantener la lista completa en memoria.
+    """
+
+    def __init__(self, path, name, crs=None):
+        self.path = path
+        self.name = name
+        self.crs = crs
+        self.count = 0
+        self._f = None
+
+    def __enter__(self):
+        self._f = open(self.path, 'w', encoding='utf-8')
+        header = {"type": "FeatureCollection", "name": self.name}
+        if self.crs is not None:
+            header["crs"] = self.crs
+        # Abrimos el objeto y dejamos la lista 'features' abierta
+        self._f.write(json.dumps(header, separators=(',', ':'))[:-1] + ',"features":[')
+        return self
+
+    def write(self, feature):
+        if self.count:
+            self._f.write(',')
+        self._f.write(json.dumps(feature, separators=(',', ':')))
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        self._f.write(']}')
+        self._f.close()
+
+
+def leer_features_streaming(path):
+    """Itera las features del GeoJSON una a una (números como float)."""
+    with open(path, 'rb') as f:
+        yield from ijson.items(f, 'features.item', use_float=True)
+
+
+def leer_crs_streaming(path):
+    """Lee solo el 'crs' del GeoJSON (suele estar antes de las features)."""
+    with open(path, 'rb') as f:
+        return next(ijson.items(f, 'crs', use_float=True), None)
+
+
+def guardar_grid(grid):
+    # El mapa pide al servidor las celdas del viewport en lugar de
+    # pintar un punto por edificio.
+    print(f"\nGuardando celdas de población en: {grid_file}")
+    grid.write(grid_file)
+    for size, cells in grid.cells.items():
+        print(f" -> Celdas de {size} m: {len(cells)}")
+
+
+def escribir_grid(puntos):
+    """Cuadrículas de población agregada a partir de (lon, lat, población)."""
+    grid = GridAccumulator()
+    for lon, lat, pop in puntos:
+        grid.add(lon, lat, pop)
+    guardar_grid(grid)
+
+
+def procesar_en_memoria():
     # --- 2. Cargar el archivo GeoJSON ---
     print(f"\nCargando {input_file}...")
     original_geojson = None
     with open(input_file, 'r', encoding='utf-8') as f:
         original_geojson = json.load(f)
-    
+
     all_features = original_geojson.get('features', [])
     print(f"Total de edificios cargados: {len(all_features)}")
 
     # --- 3. (Paso 1) Filtrar por uso residencial ---
     residential_features = []
     for feature in all_features:
-        properties = feature.get('properties', {})
-        if properties.get('currentUse') == '1_residential':
+        if es_residencial(feature):
             # Hacemos una copia para no modificar el original en memoria
-            residential_features.append(feature.copy()) 
-            
+            residential_features.append(feature.copy())
+
     print(f"Edificios filtrados por '1_residential': {len(residential_features)}")
 
     if not residential_features:
         print("No se encontraron edificios residenciales.")
+        return
+
+    # --- 4. (Paso 2) Calcular viviendas totales ---
+    total_viviendas = 0
+    for feature in residential_features:
+        dwellings = limpiar_viviendas(feature.get('properties', {}).get('numberOfDwellings'))
+        total_viviendas += dwellings
+        # Guardamos el valor limpio para usarlo después
+        feature['properties']['numberOfDwellings_clean'] = dwellings
+
+    print(f"Número total de viviendas (numberOfDwellings): {total_viviendas}")
+
+    # --- 5. (Paso 3) Calcular el índice ---
+    if total_viviendas == 0:
+        print("Error: El total de viviendas es 0. No se puede calcular el índice.")
+        return
+
+    habitantes_por_vivienda = POBLACION_BARCELONA / float(total_viviendas)
+
+    print(f"\n--- Resultados del Cálculo ---")
+    print(f"Índice calculado (habitantes por vivienda): {habitantes_por_vivienda:.4f}")
+
+    # --- 6. (Paso 4 y 5) Calcular población, centroide y FILTRAR PROPIEDADES ---
+    print("Calculando población, centroides y filtrando propiedades...")
+
+    final_features = [] # Esta será nuestra lista de features finales
+
+    for feature in residential_features:
+        dwellings_clean = feature['properties'].get('numberOfDwellings_clean', 0)
+        try:
+            final_features.append(crear_punto(feature, dwellings_clean, habitantes_por_vivienda))
+        except Exception as e:
+            gml_id = feature.get('properties', {}).get('gml_id', 'ID_DESCONOCIDO')
+            print(f"Advertencia: No se pudo procesar {gml_id}. Omitiendo. Error: {e}")
+
+    print(f"Total de {len(final_features)} edificios convertidos a puntos.")
+
+    # --- 7. Guardar el nuevo GeoJSON ---
+    new_geojson = {
+        "type": "FeatureCollection",
+        "name": OUTPUT_NAME,
+        "features": final_features # Usamos la nueva lista de features filtradas
+    }
+    if 'crs' in original_geojson:
+        new_geojson['crs'] = original_geojson['crs']
+
+    print(f"\nGuardando resultados en: {output_file}")
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(new_geojson, f, indent=2)
+
+    print("¡Análisis completado y archivo guardado!")
+
+    # --- 8. Cuadrículas de población agregada (varias resoluciones) ---
+    escribir_grid(
+        (f['geometry']['coordinates'][0], f['geometry']['coordinates'][1], f['properties']['poblacion_estimada'])
+        for f in final_features
+    )
+
+
+def procesar_streaming():
+    """
+    Mismo resultado que 'procesar_en_memoria' pero leyendo el GeoJSON en dos
+    pasadas incrementales: la memoria no depende del tamaño del archivo.
+    """
+    if ijson is None:
+        print("Error: el modo streaming necesita 'ijson' (pip install ijson).")
+        return
+
+    # --- 2-4. Primera pasada: contar edificios residenciales y viviendas ---
+    print(f"\nPrimera pasada (streaming) sobre {input_file}...")
+    total_edificios = 0
+    total_residenciales = 0
+    total_viviendas = 0
+    for feature in leer_features_streaming(input_file):
+        total_edificios += 1
+        if es_residencial(feature):
+            total_residenciales += 1
+            total_viviendas += limpiar_viviendas(feature['properties'].get('numberOfDwellings'))
+
+    print(f"Total de edificios leídos: {total_edificios}")
+    print(f"Edificios filtrados por '1_residential': {total_residenciales}")
+    print(f"Número total de viviendas (numberOfDwellings): {total_viviendas}")
+
+    if not total_residenciales:
+        print("No se encontraron edificios residenciales.")
+        return
+
+    # --- 5. Calcular el índice ---
+    if total_viviendas == 0:
+        print("Error: El total de viviendas es 0. No se puede calcular el índice.")
+        return
+
+    habitantes_por_vivienda = POBLACION_BARCELONA / float(total_viviendas)
+
+    print(f"\n--- Resultados del Cálculo ---")
+    print(f"Índice calculado (habitantes por vivienda): {habitantes_por_vivienda:.4f}")
+
+    # --- 6-8. Segunda pasada: escribir puntos y acumular celdas a la vez ---
+    print(f"\nSegunda pasada: guardando resultados en: {output_file}")
+    grid = GridAccumulator()
+    with EscritorGeoJSON(output_file, OUTPUT_NAME, crs=leer_crs_streaming(input_file)) as writer:
+        for feature in leer_features_streaming(input_file):
+            if not es_residencial(feature):
+                continue
+            dwellings_clean = limpiar_viviendas(feature['properties'].get('numberOfDwellings'))
+            try:
+                point = crear_punto(feature, dwellings_clean, habitantes_por_vivienda)
+            except Exception as e:
+                gml_id = feature.get('properties', {}).get('gml_id', 'ID_DESCONOCIDO')
+                print(f"Advertencia: No se pudo procesar {gml_id}. Omitiendo. Error: {e}")
+                continue
+            writer.write(point)
+            lon, lat = point['geometry']['coordinates'][:2]
+            grid.add(lon, lat, point['properties']['poblacion_estimada'])
+
+    print(f"Total de {writer.count} edificios convertidos a puntos.")
+    print("¡Análisis completado y archivo guardado!")
+
+    guardar_grid(grid)
+
+
+def limpiar_viviendas_vectorial(serie):
+    """
+    Equivalente vectorizado de 'limpiar_viviendas': números truncados hacia
+    cero, booleanos como 1/0 y el resto a 0. Si la columna mezcla números y
+    textos, GDAL la lee entera como texto ("2.7000000000000002", "2.0"), así
+    que los textos numéricos también se truncan como el número original.
+    """
+    if pd.api.types.is_bool_dtype(serie):
+        return serie.fillna(False).astype("int64")
+    if pd.api.types.is_numeric_dtype(serie):
+        numeros = serie.astype("float64")
+    else:
+        texto = serie.astype("string").str.strip()
+        numeros = pd.to_numeric(texto, errors="coerce").astype("float64")
+        booleanos = texto.str.lower().map({"true": 1.0, "false": 0.0}).astype("float64")
+        numeros = numeros.fillna(booleanos)
+    numeros = numeros.where(np.isfinite(numeros), 0.0)
+    return np.trunc(numeros).astype("int64")
+
+
+def valores_json(serie):
+    """Valores de una columna como tipos de Python (NaN -> None, floats enteros -> int)."""
+    if pd.api.types.is_float_dtype(serie):
+        no_nulos = serie.dropna()
+        if len(no_nulos) and (no_nulos % 1 == 0).all():
+            serie = serie.astype("Int64")
+    return serie.astype(object).where(serie.notna(), None).tolist()
+
+
+def crs_geojson(crs):
+    """Bloque 'crs' de GeoJSON a partir del CRS de GeoPandas."""
+    if crs is None:
+        return None
+    autoridad = crs.to_authority()
+    if autoridad is None:
+        return None
+    auth, code = autoridad
+    name = f"urn:ogc:def:crs:OGC:1.3:{code}" if auth == "OGC" else f"urn:ogc:def:crs:{auth}::{code}"
+    return {"type": "name", "properties": {"name": name}}
+
+
+# Bloque 'crs' de los puntos guardados en lon/lat (EPSG:4326)
+CRS_LONLAT = {"type": "name", "properties": {"name": "urn:ogc:def:crs:OGC:1.3:CRS84"}}
+
+
+def puntos_residenciales(gdf):
+    """
+    Edificios residenciales de un GeoDataFrame con su referencia, metros,
+    viviendas limpias y punto representativo (None si no tienen geometría).
+    """
+    if "currentUse" in gdf.columns:
+        residencial = gdf[gdf["currentUse"] == "1_residential"]
+    else:
+        residencial = gdf.iloc[0:0]
+
+    if "numberOfDwellings" in residencial.columns:
+        viviendas = limpiar_viviendas_vectorial(residencial["numberOfDwellings"])
     else:
-        # --- 4. (Paso 2) Calcular viviendas totales ---
-        total_viviendas = 0
-        for feature in residential_features:
-            dwellings = 0
-            # Obtenemos el n.º de viviendas (puede ser None, str, int)
-            raw_dwellings = feature.get('properties', {}).get('numberOfDwellings')
-            
-            # Limpiamos el dato
-            if isinstance(raw_dwellings, (int, float)):
-                dwellings = int(raw_dwellings)
-            elif isinstance(raw_dwellings, str):
-                try:
-                    dwellings = int(raw_dwellings)
-                except (ValueError, TypeError):
-                    dwellings = 0
-            
-            total_viviendas += dwellings
-            # Guardamos el valor limpio para usarlo después
-            feature['properties']['numberOfDwellings_clean'] = dwellings
-
-        print(f"Número total de viviendas (numberOfDwellings): {total_viviendas}")
-
-        # --- 5. (Paso 3) Calcular el índice ---
-        if total_viviendas == 0:
-            print("Error: El total de viviendas es 0. No se puede calcular el índice.")
-        else:
-            habitantes_por_vivienda = POBLACION_BARCELONA / float(total_viviendas)
-            
-            print(f"\n--- Resultados del Cálculo ---")
-            print(f"Índice calculado (habitantes por vivienda): {habitantes_por_vivienda:.4f}")
-
-            # --- 6. (Paso 4 y 5) Calcular población, centroide y FILTRAR PROPIEDADES ---
-            print("Calculando población, centroides y filtrando propiedades...")
-            
-            final_features = [] # Esta será nuestra lista de features finales
-            
-            for feature in residential_features:
-                
-                # --- Asignar población ---
-                dwellings_clean = feature['properties'].get('numberOfDwellings_clean', 0)
-                estimated_pop = dwellings_clean * habitantes_por_vivienda
-                
-                # --- Convertir geometría a Punto (Centroide) ---
-                try:
-                    original_geom = shape(feature['geometry'])
-                    centroid_point = original_geom.representative_point()
-                    
-                    # --- (NUEVO) Crear el diccionario de propiedades filtradas ---
-                    old_props = feature.get('properties', {})
-                    
-                    new_props = {
-                        # Mapeamos los nombres originales a los que pediste
-                        "referencia_catastral": old_props.get('reference'),
-                        "metros_cuadrados": old_props.get('value'),
-                        "viviendas": dwellings_clean,
-                        "poblacion_estimada": estimated_pop
-                    }
-
-                    # --- (NUEVO) Crear la 'feature' final ---
-                    final_feature = {
-                        "type": "Feature",
-                        "geometry": mapping(centroid_point), # Geometría de punto
-                        "properties": new_props              # Solo las propiedades filtradas
-                    }
-                    
-                    final_features.append(final_feature) # Añadir la nueva feature
-                    
-                except Exception as e:
-                    gml_id = feature.get('properties', {}).get('gml_id', 'ID_DESCONOCIDO')
-                    print(f"Advertencia: No se pudo procesar {gml_id}. Omitiendo. Error: {e}")
-
-            print(f"Total de {len(final_features)} edificios convertidos a puntos.")
-
-            # --- 7. Guardar el nuevo GeoJSON ---
-            new_geojson = {
-                "type": "FeatureCollection",
-                "name": "barcelona_population_points",
-                "features": final_features # Usamos la nueva lista de features filtradas
-            }
-            if 'crs' in original_geojson:
-                new_geojson['crs'] = original_geojson['crs']
-
-            print(f"\nGuardando resultados en: {output_file}")
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(new_geojson, f, indent=2)
-                
-            print("¡Análisis completado y archivo guardado!")
-
-except FileNotFoundError:
-    print(f"Error: No se encontró el archivo de entrada: {input_file}")
-except Exception as e:
-    print(f"Ha ocurrido un error inesperado: {e}")
\ No newline at end of file
+        viviendas = pd.Series(0, index=residencial.index, dtype="int64")
+
+    geoms = residencial.geometry.values
+    validos = ~(shapely.is_missing(geoms) | shapely.is_empty(geoms))
+    puntos = np.full(len(residencial), None, dtype=object)
+    puntos[validos] = shapely.point_on_surface(geoms[validos])
+
+    def columna(nombre):
+        if nombre in residencial.columns:
+            return residencial[nombre].to_numpy()
+        return np.full(len(residencial), None, dtype=object)
+
+    return gpd.GeoDataFrame(
+        {"reference": columna("reference"), "value": columna("value"), "viviendas": viviendas.to_numpy()},
+        geometry=gpd.GeoSeries(puntos, crs=gdf.crs),
+    )
+
+
+def escribir_puntos(puntos, habitantes_por_vivienda, crs):
+    """Guarda los puntos con su población estimada y las cuadrículas agregadas."""
+    validos = puntos.geometry.notna().to_numpy()
+    if not validos.all():
+        print(f"Advertencia: {int((~validos).sum())} edificios sin geometría. Omitiendo.")
+    puntos = puntos[validos]
+
+    coords = shapely.get_coordinates(puntos.geometry.values)
+    poblacion = puntos["viviendas"].to_numpy() * habitantes_por_vivienda
+
+    # --- 7. Guardar el nuevo GeoJSON ---
+    print(f"\nGuardando resultados en: {output_file}")
+    with EscritorGeoJSON(output_file, OUTPUT_NAME, crs=crs) as writer:
+        for (x, y), ref, m2, viv, pob in zip(
+            coords.tolist(), valores_json(puntos["reference"]), valores_json(puntos["value"]),
+            puntos["viviendas"].tolist(), poblacion.tolist()
+        ):
+            writer.write({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [x, y]},
+                "properties": {
+                    "referencia_catastral": ref,
+                    "metros_cuadrados": m2,
+                    "viviendas": viv,
+                    "poblacion_estimada": pob,
+                },
+            })
+
+    print(f"Total de {writer.count} edificios convertidos a puntos.")
+    print("¡Análisis completado y archivo guardado!")
+
+    # --- 8. Cuadrículas de población agregada (varias resoluciones) ---
+    grid = GridAccumulator()
+    grid.add_many(coords[:, 0], coords[:, 1], poblacion)
+    guardar_grid(grid)
+
+
+def indice_habitantes(total_viviendas):
+    """Habitantes por vivienda, o None si no hay viviendas."""
+    print(f"Número total de viviendas (numberOfDwellings): {total_viviendas}")
+    if total_viviendas == 0:
+        print("Error: El total de viviendas es 0. No se puede calcular el índice.")
+        return None
+
+    habitantes_por_vivienda = POBLACION_BARCELONA / float(total_viviendas)
+    print(f"\n--- Resultados del Cálculo ---")
+    print(f"Índice calculado (habitantes por vivienda): {habitantes_por_vivienda:.4f}")
+    return habitantes_por_vivienda
+
+
+def procesar_vectorial():
+    """
+    Mismo resultado que 'procesar_en_memoria' pero con GeoPandas: filtros,
+    limpieza de viviendas y puntos representativos se calculan sobre
+    columnas enteras (shapely 2) en lugar de edificio a edificio.
+    """
+    if gpd is None:
+        print("Error: el modo vectorial necesita 'geopandas' y 'shapely>=2'.")
+        return
+
+    # --- 2. Cargar el archivo GeoJSON ---
+    print(f"\nCargando {input_file} con GeoPandas...")
+    gdf = gpd.read_file(input_file)
+    print(f"Total de edificios cargados: {len(gdf)}")
+
+    # --- 3-6. Residenciales, viviendas y puntos representativos en bloque ---
+    puntos = puntos_residenciales(gdf)
+    print(f"Edificios filtrados por '1_residential': {len(puntos)}")
+    if puntos.empty:
+        print("No se encontraron edificios residenciales.")
+        return
+
+    habitantes_por_vivienda = indice_habitantes(int(puntos["viviendas"].sum()))
+    if habitantes_por_vivienda is None:
+        return
+
+    # El 'crs' original se copia tal cual si se puede leer sin cargar el archivo
+    crs = leer_crs_streaming(input_file) if ijson is not None else crs_geojson(gdf.crs)
+    escribir_puntos(puntos, habitantes_por_vivienda, crs)
+
+
+def procesar_incremental():
+    """
+    Trabaja sobre las particiones por municipio de 'merge_buildings.py
+    --incremental': solo recalcula los puntos de las particiones cuyo hash
+    ha cambiado y después combina todas para aplicar el índice global.
+    """
+    if gpd is None:
+        print("Error: el modo incremental necesita 'geopandas' y 'shapely>=2'.")
+        return
+
+    from merge_buildings import PARTS_DIR, cargar_manifest, deduplicar_edificios, files_to_merge
+
+    manifest = cargar_manifest()
+    if not manifest.get("files"):
+        print(f"Error: no hay particiones en {PARTS_DIR}. Ejecuta antes 'merge_buildings.py --incremental'.")
+        return
+
+    os.makedirs(POPULATION_PARTS_DIR, exist_ok=True)
+    pop_manifest = {}
+    if os.path.exists(POPULATION_MANIFEST_FILE):
+        with open(POPULATION_MANIFEST_FILE, "r", encoding="utf-8") as f:
+            pop_manifest = json.load(f)
+
+    partes = []
+    nuevo_manifest = {}
+    for filename in files_to_merge:
+        entrada = manifest["files"].get(filename)
+        if entrada is None:
+            continue
+        destino = os.path.join(POPULATION_PARTS_DIR, entrada["partition"])
+        partes.append(destino)
+        nuevo_manifest[filename] = {"sha256": entrada["sha256"], "partition": entrada["partition"]}
+
+        if pop_manifest.get(filename, {}).get("sha256") == entrada["sha256"] and os.path.exists(destino):
+            print(f"Sin cambios: {filename}")
+            continue
+
+        print(f"Recalculando puntos de: {filename}")
+        edificios = gpd.read_parquet(os.path.join(PARTS_DIR, entrada["partition"]))
+        puntos = puntos_residenciales(edificios)
+        # Los puntos se guardan en lon/lat, como en la salida final
+        puntos.to_crs("EPSG:4326").to_parquet(destino)
+
+    with open(POPULATION_MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(nuevo_manifest, f, indent=2)
+
+    # --- Combinar particiones y aplicar el índice global ---
+    puntos = pd.concat([gpd.read_parquet(p) for p in partes], ignore_index=True)
+    puntos = deduplicar_edificios(puntos)
+    print(f"Edificios filtrados por '1_residential': {len(puntos)}")
+    if puntos.empty:
+        print("No se encontraron edificios residenciales.")
+        return
+
+    habitantes_por_vivienda = indice_habitantes(int(puntos["viviendas"].sum()))
+    if habitantes_por_vivienda is None:
+        return
+    escribir_puntos(puntos, habitantes_por_vivienda, CRS_LONLAT)
+
+
+MODOS = {
+    "memoria": procesar_en_memoria,
+    "streaming": procesar_streaming,
+    "vectorial": procesar_vectorial,
+    "incremental": procesar_incremental,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimación de población por edificio residencial.")
+    parser.add_argument(
+        "--modo", choices=sorted(MODOS), default="memoria",
+        help="'streaming' lee y escribe feature a feature (memoria constante); "
+             "'vectorial' calcula con GeoPandas/shapely 2 sobre columnas enteras; "
+             "'incremental' solo recalcula los municipios que han cambiado",
+    )
+    args = parser.parse_args()
+
+    print(f"Iniciando análisis de población (con salida de PUNTOS).")
+    print(f"Archivo de entrada: {input_file}")
+    print(f"Archivo de salida: {output_file}")
+    print(f"Población total de Barcelona (2024): {POBLACION_BARCELONA}")
+    print(f"Modo: {args.modo}")
+
+    try:
+        MODOS[args.modo]()
+    except FileNotFoundError:
+        print(f"Error: No se encontró el archivo de entrada: {input_file}")
+    except Exception as e:
+        print(f"Ha ocurrido un error inesperado: {e}")
@@ -0,0 +1,148 @@
+import json
+import math
+import os
+import threading
+
+import numpy as np
+
+
+DATA_DIR = os.path.join("static", "data")
+POPULATION_GRID_FILE = os.path.join(DATA_DIR, "population_grid.json")
+
+# Mida de cel·la (metres Web Mercator) segons el zoom mínim del mapa on s'usa
+GRID_CELL_SIZES = {
+    0: 3200,
+    11: 800,
+    13: 200,
+    15: 50,
+}
+# Màxim de cel·les per resposta; si se supera es passa a una graella més grossa
+MAX_CELLS = 20000
+
+WORLD_HALF = 20037508.342789244
+
+
+def lonlat_to_mercator(lon, lat):
+    x = np.asarray(lon, dtype=float) * WORLD_HALF / 180.0
+    y = np.log(np.tan((90.0 + np.asarray(lat, dtype=float)) * np.pi / 360.0)) * WORLD_HALF / np.pi
+    return x, y
+
+
+def mercator_to_lonlat(x, y):
+    lon = np.asarray(x, dtype=float) / WORLD_HALF * 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.asarray(y, dtype=float) / WORLD_HALF * np.pi)))
+    return lon, lat
+
+
+class GridAccumulator:
+    """
+    Suma població per cel·la a totes les resolucions alhora. Es pot alimentar
+    punt a punt (add) o amb arrays (add_many), així serveix tant per a
+    lectures en streaming com per a processos vectoritzats.
+    """
+
+    def __init__(self, cell_sizes=None):
+        self.cell_sizes = dict(cell_sizes or GRID_CELL_SIZES)
+        self.cells = {size: {} for size in self.cell_sizes.values()}
+
+    def add(self, lon: float, lat: float, population: float):
+        x = lon * WORLD_HALF / 180.0
+        y = math.log(math.tan((90.0 + lat) * math.pi / 360.0)) * WORLD_HALF / math.pi
+        for size, cells in self.cells.items():
+            key = (math.floor(x / size), math.floor(y / size))
+            cells[key] = cells.get(key, 0.0) + population
+
+    def add_many(self, lon, lat, population):
+        x, y = lonlat_to_mercator(lon, lat)
+        population = np.asarray(population, dtype=float)
+        for size, cells in self.cells.items():
+            ix = np.floor(x / size).astype(np.int64)
+            iy = np.floor(y / size).astype(np.int64)
+            keys, inverse = np.unique(np.stack([ix, iy], axis=1), axis=0, return_inverse=True)
+            sums = np.bincount(inverse.ravel(), weights=population, minlength=len(keys))
+            for (kx, ky), value in zip(keys.tolist(), sums.tolist()):
+                cells[(kx, ky)] = cells.get((kx, ky), 0.0) + value
+
+    def to_dict(self) -> dict:
+        return {
+            "cell_sizes": {str(zoom): size for zoom, size in self.cell_sizes.items()},
+            "grids": {
+                str(size): [[ix, iy, round(pop, 3)] for (ix, iy), pop in sorted(cells.items()) if pop > 0]
+                for size, cells in self.cells.items()
+            },
+        }
+
+    def write(self, path: str = POPULATION_GRID_FILE):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+
+
+class PopulationGrid:
+    """Graelles de població precalculades, carregades a numpy per filtrar per viewport."""
+
+    def __init__(self, path: str = POPULATION_GRID_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._zooms = None
+        self._grids = None
+
+    @property
+    def available(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _load(self):
+        mtime = os.path.getmtime(self.path)
+        if self._grids is not None and mtime == self._mtime:
+            return
+        with self._lock:
+            if self._grids is not None and mtime == self._mtime:
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            grids = {}
+            for size, cells in raw["grids"].items():
+                arr = np.asarray(cells, dtype=float).reshape(-1, 3)
+                grids[float(size)] = arr
+            self._zooms = sorted((int(z), float(s)) for z, s in raw["cell_sizes"].items())
+            self._grids = grids
+            self._mtime = mtime
+
+    def query(self, bbox, zoom: float) -> dict:
+        """
+        Cel·les dins del bbox (minlon, minlat, maxlon, maxlat) a la resolució
+        que toca pel zoom, com a FeatureCollection de punts al centre de cada
+        cel·la. 'pes' és la població relativa a la cel·la més poblada.
+        """
+        self._load()
+        minx, miny = lonlat_to_mercator(bbox[0], bbox[1])
+        maxx, maxy = lonlat_to_mercator(bbox[2], bbox[3])
+
+        candidates = [size for z, size in self._zooms if z <= zoom] or [self._zooms[0][1]]
+        for size in reversed(candidates):
+            cells = self._grids[size]
+            ix, iy = cells[:, 0], cells[:, 1]
+            inside = (
+                (ix >= np.floor(minx / size)) & (ix <= np.floor(maxx / size))
+                & (iy >= np.floor(miny / size)) & (iy <= np.floor(maxy / size))
+            )
+            if inside.sum() <= MAX_CELLS or size == candidates[0]:
+                break
+
+        selected = cells[inside]
+        lon, lat = mercator_to_lonlat((selected[:, 0] + 0.5) * size, (selected[:, 1] + 0.5) * size)
+        population = selected[:, 2]
+        top = population.max() if len(population) else 1.0
+
+        return {
+            "type": "FeatureCollection",
+            "cell_size": size,
+            "features": [
+                {
+                    "type": "Feature",
+                    "geometry": {"type": "Point", "coordinates": [round(x, 6), round(y, 6)]},
+                    "properties": {"poblacion_estimada": round(p, 1), "pes": round(p / top, 4)},
+                }
+                for x, y, p in zip(lon.tolist(), lat.tolist(), population.tolist())
+            ],
+        }
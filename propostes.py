@@ -0,0 +1,71 @@
+import json
+import os
+
+import pandas as pd
+
+
+DATA_DIR = os.path.join("static", "data")
+
+# Línies proposades pel projecte SmartMetro
+PROPOSALS = {
+    "L12": os.path.join(DATA_DIR, "L12.geojson"),
+    "L1": os.path.join(DATA_DIR, "ampliacio_l1.geojson"),
+}
+
+NAME_PROPERTIES = ("name", "nom", "NOM", "NOM_ESTACIO", "Name")
+
+
+def feature_name(props: dict):
+    for key in NAME_PROPERTIES:
+        if props.get(key):
+            return str(props[key])
+    return None
+
+
+def line_vertices(geometry: dict):
+    """Vèrtexs d'una LineString/MultiLineString, sense repetir punts consecutius."""
+    if geometry["type"] == "LineString":
+        parts = [geometry["coordinates"]]
+    elif geometry["type"] == "MultiLineString":
+        parts = geometry["coordinates"]
+    else:
+        return []
+
+    vertices = []
+    for part in parts:
+        for lon, lat, *_ in part:
+            if not vertices or vertices[-1] != (lon, lat):
+                vertices.append((lon, lat))
+    return vertices
+
+
+def load_proposed_stops(proposals: dict = PROPOSALS) -> pd.DataFrame:
+    """
+    Parades de les línies proposades (nom, linia, lon, lat). Si el GeoJSON té
+    punts, cada punt és una parada; si només té el traçat, es fan servir els
+    vèrtexs de la línia, que es dibuixa parada a parada.
+    """
+    rows = []
+    for line, path in proposals.items():
+        if not os.path.exists(path):
+            print(f"Falta el traçat de la {line}: {path}")
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            features = json.load(f).get("features", [])
+
+        points = [f for f in features if (f.get("geometry") or {}).get("type") == "Point"]
+        if points:
+            for i, feat in enumerate(points, start=1):
+                lon, lat = feat["geometry"]["coordinates"][:2]
+                name = feature_name(feat.get("properties") or {}) or f"{line} parada {i}"
+                rows.append({"nom": name, "linia": line, "lon": lon, "lat": lat})
+            continue
+
+        vertices = []
+        for feat in features:
+            if feat.get("geometry"):
+                vertices.extend(line_vertices(feat["geometry"]))
+        for i, (lon, lat) in enumerate(dict.fromkeys(vertices), start=1):
+            rows.append({"nom": f"{line} parada {i}", "linia": line, "lon": lon, "lat": lat})
+
+    return pd.DataFrame(rows, columns=["nom", "linia", "lon", "lat"])
@@ -0,0 +1,354 @@
+import asyncio
+import json
+import random
+import time
+
+import httpx
+
+
+PUBLICAI_BASE_URL = "https://api.publicai.co/v1/chat/completions"
+PUBLICAI_MODEL = "BSC-LT/salamandra-7b-instruct-tools-16k"
+
+# Codis que val la pena reintentar: límit d'ús i errors temporals del servidor
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Quota per defecte de la clau (aprox. 20 peticions/minut, veure aina/README.md) i ràfega màxima
+PUBLICAI_REQUESTS_PER_MINUTE = 20
+PUBLICAI_BURST = 5
+
+
+class PublicAIError(Exception):
+    """Resposta d'error de PublicAI després d'esgotar els reintents."""
+
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f"PublicAI {status_code}: {text[:200]}")
+        self.status_code = status_code
+        self.text = text
+
+
+class TokenBucket:
+    """
+    Limitador de ritme (token bucket): 'rate' peticions per segon amb ràfegues
+    de fins a 'capacity'. Quan no queden fitxes, 'acquire' espera en ordre
+    d'arribada en lloc de fallar.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class StreamFlight:
+    """Fragments d'un stream compartit entre totes les peticions idèntiques en curs."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Condition()
+
+    async def publish(self, chunk=None, error=None, done=False):
+        async with self.changed:
+            if chunk is not None:
+                self.chunks.append(chunk)
+            self.error = error
+            self.done = done
+            self.changed.notify_all()
+
+    async def follow(self):
+        i = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: i < len(self.chunks) or self.done)
+                chunks = self.chunks[i:]
+                done, error = self.done, self.error
+            for chunk in chunks:
+                yield chunk
+            i += len(chunks)
+            if done and i == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class PublicAIClient:
+    """
+    Client asíncron de PublicAI amb connexions reutilitzades (keep-alive),
+    un màxim de peticions simultànies i reintents amb espera exponencial i
+    jitter davant de 429/5xx o errors de xarxa.
+
+    Les peticions idèntiques que coincideixen en el temps comparteixen una
+    sola crida (single-flight) i totes passen per un token bucket ajustat a
+    la quota de la clau ('requests_per_minute'; None el desactiva).
+
+    El client httpx i el semàfor es creen a la primera petició perquè quedin
+    lligats al bucle d'esdeveniments del servidor.
+    """
+
+    def __init__(self, api_key: str | None, base_url: str = PUBLICAI_BASE_URL, model: str = PUBLICAI_MODEL,
+                 max_concurrency: int = 8, max_retries: int = 3, timeout: float = 30.0,
+                 backoff: float = 0.5, max_backoff: float = 8.0,
+                 requests_per_minute: float | None = PUBLICAI_REQUESTS_PER_MINUTE, burst: int = PUBLICAI_BURST):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.limiter = TokenBucket(requests_per_minute / 60.0, burst) if requests_per_minute else None
+
+        self._client = None
+        self._semaphore = None
+        self._flights = {}
+        self._streams = {}
+
+    @property
+    def headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "User-Agent": "UAB-THE-HACK/1.0",
+        }
+
+    def _ensure_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=httpx.Timeout(self.timeout, connect=5.0),
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    def _delay(self, attempt: int, response: httpx.Response | None = None) -> float:
+        """Espera abans del reintent: Retry-After si n'hi ha, si no exponencial amb jitter."""
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.max_backoff)
+                except ValueError:
+                    pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def payload(self, messages, max_tokens: int, temperature: float, **extra) -> dict:
+        return {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            **extra,
+        }
+
+    async def _wait_turn(self):
+        if self.limiter is not None:
+            await self.limiter.acquire()
+
+    @staticmethod
+    def flight_key(payload: dict) -> str:
+        return json.dumps(payload, sort_keys=True, ensure_ascii=False)
+
+    async def post(self, payload: dict) -> httpx.Response:
+        """
+        POST amb reintents. Retorna la resposta 200 o llança PublicAIError /
+        httpx.TimeoutException. Si ja hi ha una petició idèntica en curs,
+        n'espera el resultat en lloc de fer-ne una altra.
+        """
+        key = self.flight_key(payload)
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._post(payload))
+            self._flights[key] = task
+            task.add_done_callback(lambda _: self._flights.pop(key, None))
+        # shield: si una petició es cancel·la, les altres continuen esperant
+        return await asyncio.shield(task)
+
+    async def _post(self, payload: dict) -> httpx.Response:
+        client = self._ensure_client()
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            await self._wait_turn()
+            try:
+                async with self._semaphore:
+                    resp = await client.post(self.base_url, json=payload)
+            except httpx.TransportError as e:
+                if last:
+                    raise
+                print(f"PublicAI: error de xarxa ({e!r}), reintent {attempt + 1}")
+                await asyncio.sleep(self._delay(attempt))
+                continue
+
+            if resp.status_code == 200:
+                return resp
+            if resp.status_code not in RETRY_STATUS or last:
+                raise PublicAIError(resp.status_code, resp.text)
+
+            print(f"PublicAI: {resp.status_code}, reintent {attempt + 1}")
+            await asyncio.sleep(self._delay(attempt, resp))
+
+    async def complete(self, messages, max_tokens: int = 512, temperature: float = 0.7) -> str:
+        """Resposta completa del model per a 'messages'."""
+        resp = await self.post(self.payload(messages, max_tokens, temperature))
+        return resp.json()["choices"][0]["message"]["content"]
+
+    async def complete_with_tools(self, messages, tools: list, run_tool, max_rounds: int = 3,
+                                  max_tokens: int = 512, temperature: float = 0.7) -> str:
+        """
+        Resposta final amb crides a eines (protocol 'tools' / 'tool_calls' d'OpenAI).
+        'run_tool(call)' executa cada crida i retorna el missatge 'tool' amb el
+        resultat. Després de 'max_rounds' rondes es demana la resposta sense eines;
+        si el model encara hi respon amb crides, es retorna el text que porti ("" si cap).
+        """
+        messages = list(messages)
+        for round_ in range(max_rounds + 1):
+            extra = {"tools": tools, "tool_choice": "auto"} if round_ < max_rounds else {}
+            resp = await self.post(self.payload(messages, max_tokens, temperature, **extra))
+            message = resp.json()["choices"][0]["message"]
+            tool_calls = message.get("tool_calls")
+            if not tool_calls or round_ == max_rounds:
+                return message.get("content") or ""
+
+            messages.append({"role": "assistant", "content": message.get("content") or "", "tool_calls": tool_calls})
+            messages.extend(run_tool(call) for call in tool_calls)
+
+    async def stream(self, messages, max_tokens: int = 512, temperature: float = 0.7):
+        """
+        Fragments de text de la resposta a mesura que arriben (stream: true,
+        format SSE d'OpenAI). Els streams idèntics en curs comparteixen la
+        mateixa crida: qui arriba tard rep també els fragments ja emesos.
+        """
+        async for delta in self.stream_deltas(self.payload(messages, max_tokens, temperature, stream=True)):
+            if delta.get("content"):
+                yield delta["content"]
+
+    async def stream_with_tools(self, messages, tools: list, run_tool, max_rounds: int = 3,
+                                max_tokens: int = 512, temperature: float = 0.7):
+        """
+        Com 'complete_with_tools' però en streaming: les rondes amb crides a
+        eines s'acumulen i s'executen sense emetre res, i només es reenvien els
+        fragments de text de la resposta final. El text que arribi dins d'una
+        ronda abans de la primera crida ja s'ha emès (els models amb eines no
+        en solen enviar).
+        """
+        messages = list(messages)
+        for round_ in range(max_rounds + 1):
+            extra = {"tools": tools, "tool_choice": "auto"} if round_ < max_rounds else {}
+            payload = self.payload(messages, max_tokens, temperature, stream=True, **extra)
+            content = []
+            calls = {}
+            async for delta in self.stream_deltas(payload):
+                for part in delta.get("tool_calls") or []:
+                    call = calls.setdefault(part.get("index", len(calls)), {
+                        "id": None, "type": "function", "function": {"name": "", "arguments": ""},
+                    })
+                    call["id"] = part.get("id") or call["id"]
+                    function = part.get("function") or {}
+                    call["function"]["name"] += function.get("name") or ""
+                    call["function"]["arguments"] += function.get("arguments") or ""
+                if delta.get("content"):
+                    content.append(delta["content"])
+                    if not calls:
+                        yield delta["content"]
+
+            if not calls or round_ == max_rounds:
+                return
+
+            tool_calls = [calls[i] for i in sorted(calls)]
+            messages.append({"role": "assistant", "content": "".join(content), "tool_calls": tool_calls})
+            messages.extend(run_tool(call) for call in tool_calls)
+
+    async def stream_deltas(self, payload: dict):
+        """
+        'delta' de cada fragment del stream ('content' i/o 'tool_calls'). Els
+        streams idèntics en curs comparteixen la mateixa crida a PublicAI.
+        """
+        key = self.flight_key(payload)
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = StreamFlight()
+            self._streams[key] = flight
+            asyncio.ensure_future(self._pump(key, payload, flight))
+        async for delta in flight.follow():
+            yield delta
+
+    async def _pump(self, key: str, payload: dict, flight: StreamFlight):
+        """Llegeix el stream de PublicAI i el publica a 'flight' (independent de qui l'escolta)."""
+        try:
+            async for chunk in self._stream_upstream(payload):
+                await flight.publish(chunk)
+        except Exception as e:
+            await flight.publish(error=e, done=True)
+        else:
+            await flight.publish(done=True)
+        finally:
+            self._streams.pop(key, None)
+
+    async def _stream_upstream(self, payload: dict):
+        """Stream d'una sola crida. Només es reintenta si encara no s'ha rebut res."""
+        client = self._ensure_client()
+        started = False
+
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            retry_resp = None
+            await self._wait_turn()
+            try:
+                async with self._semaphore:
+                    async with client.stream("POST", self.base_url, json=payload) as resp:
+                        if resp.status_code != 200:
+                            text = (await resp.aread()).decode("utf-8", errors="replace")
+                            if resp.status_code not in RETRY_STATUS or last:
+                                raise PublicAIError(resp.status_code, text)
+                            retry_resp = resp
+                        else:
+                            async for line in resp.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                data = line[5:].strip()
+                                if data == "[DONE]":
+                                    return
+                                choices = json.loads(data).get("choices") or [{}]
+                                delta = choices[0].get("delta") or {}
+                                if delta.get("content") or delta.get("tool_calls"):
+                                    started = True
+                                    yield delta
+                            return
+            except httpx.TransportError as e:
+                if last or started:
+                    raise
+                print(f"PublicAI: error de xarxa ({e!r}), reintent {attempt + 1}")
+                await asyncio.sleep(self._delay(attempt))
+                continue
+
+            print(f"PublicAI: {retry_resp.status_code}, reintent {attempt + 1}")
+            await asyncio.sleep(self._delay(attempt, retry_resp))
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
+            self._flights.clear()
+            self._streams.clear()
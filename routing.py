@@ -0,0 +1,484 @@
+import json
+import os
+import re
+import unicodedata
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from analytics import LINE_PATTERN
+from catchment import CATCHMENTS_FILE
+from propostes import PROPOSALS, load_proposed_stops
+
+try:
+    import shapely
+    import shapely.geometry
+    from pyproj import Transformer
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import dijkstra
+except ImportError:
+    # Sense aquestes llibreries no hi ha càlcul de recorreguts
+    shapely = None
+    Transformer = None
+    dijkstra = None
+
+
+DATA_DIR = os.path.join("static", "data")
+METRO_LINES_FILE = os.path.join(DATA_DIR, "barcelona_metro_lines.geojson")
+
+# Xarxa actual i xarxes amb les propostes del projecte (claus de PROPOSALS)
+SCENARIOS = {
+    "actual": (),
+    "l12": ("L12",),
+    "l1": ("L1",),
+    "complet": ("L12", "L1"),
+}
+
+# Model de temps (minuts): velocitat comercial, parada i transbord
+COMMERCIAL_SPEED_KMH = 27.0
+STOP_TIME_MIN = 0.5
+TRANSFER_PENALTY_MIN = 5.0
+# Sense traçat, la distància entre parades és la recta per aquest factor
+DETOUR_FACTOR = 1.3
+# Una parada proposada a menys d'aquesta distància s'uneix a l'estació existent
+LINK_RADIUS_M = 300.0
+
+ROUTING_CRS = "EPSG:25831"
+
+
+def normalize_name(name: str) -> str:
+    """Nom d'estació sense accents, majúscules ni espais repetits (per cercar)."""
+    text = unicodedata.normalize("NFKD", str(name))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def project_coords(transformer, coords: np.ndarray) -> np.ndarray:
+    x, y = transformer.transform(coords[:, 0], coords[:, 1])
+    return np.column_stack([x, y])
+
+
+def load_line_geometries(path: str = METRO_LINES_FILE, to_utm=None) -> dict:
+    """Traçat de cada línia (L1, L3, L9S...) en EPSG:25831, si existeix el fitxer."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        features = json.load(f).get("features", [])
+
+    parts = {}
+    for feat in features:
+        props = feat.get("properties") or {}
+        geometry = feat.get("geometry")
+        if not geometry:
+            continue
+        name = props.get("NOM_LINIA") or props.get("name") or ""
+        match = re.search(LINE_PATTERN, str(name))
+        if not match:
+            continue
+        geom = shapely.transform(shapely.geometry.shape(geometry), lambda c: project_coords(to_utm, c))
+        parts.setdefault(match.group(1), []).append(geom)
+
+    return {line: shapely.line_merge(shapely.union_all(geoms)) for line, geoms in parts.items()}
+
+
+def chain_order(xy: np.ndarray) -> list:
+    """
+    Ordre aproximat de parades sense traçat: es comença per l'extrem més
+    allunyat del centre i es va a la parada més propera no visitada.
+    """
+    remaining = list(range(len(xy)))
+    if not remaining:
+        return []
+    centre = xy.mean(axis=0)
+    current = max(remaining, key=lambda i: np.hypot(*(xy[i] - centre)))
+    order = [current]
+    remaining.remove(current)
+    while remaining:
+        d = np.hypot(*(xy[remaining] - xy[current]).T)
+        current = remaining.pop(int(np.argmin(d)))
+        order.append(current)
+    return order
+
+
+def segment_minutes(distance_m: float) -> float:
+    return distance_m / (COMMERCIAL_SPEED_KMH * 1000.0 / 60.0) + STOP_TIME_MIN
+
+
+def line_sequences(station_xy: pd.DataFrame, station_lines: pd.DataFrame, geometries: dict) -> dict:
+    """
+    Estacions de cada línia en ordre i temps entre parades consecutives:
+    {línia: [(estació, minuts des de l'anterior), ...]}. L'ordre surt de
+    projectar les estacions sobre el traçat; sense traçat, d'una cadena de veïns.
+    """
+    sequences = {}
+    for line in station_lines.columns:
+        names = station_lines.index[station_lines[line].to_numpy()].tolist()
+        names = [n for n in names if n in station_xy.index]
+        if len(names) < 2:
+            continue
+        xy = station_xy.loc[names, ["x", "y"]].to_numpy()
+
+        geom = geometries.get(line)
+        if geom is not None:
+            measures = shapely.line_locate_point(geom, shapely.points(xy))
+            order = np.argsort(measures, kind="stable").tolist()
+            gaps = np.abs(np.diff(measures[order]))
+            straight = np.hypot(*np.diff(xy[order], axis=0).T)
+            # Si el traçat és a trossos la mesura pot saltar: mai menys que la recta
+            distances = np.maximum(gaps, straight)
+        else:
+            order = chain_order(xy)
+            distances = np.hypot(*np.diff(xy[order], axis=0).T) * DETOUR_FACTOR
+
+        seq = [(names[order[0]], 0.0)]
+        seq += [(names[i], segment_minutes(d)) for i, d in zip(order[1:], distances)]
+        sequences[line] = seq
+    return sequences
+
+
+def add_proposals(sequences: dict, station_xy: pd.DataFrame, stops: pd.DataFrame, lines) -> tuple:
+    """
+    Afegeix les línies proposades: cada parada s'uneix a l'estació existent
+    del mateix nom o a menys de LINK_RADIUS_M (i hi permet transbord). Una
+    línia ja existent (ampliació L1) s'allarga per l'extrem més proper.
+    """
+    sequences = dict(sequences)
+    station_xy = station_xy.copy()
+    by_name = {normalize_name(n): n for n in station_xy.index}
+
+    for line in lines:
+        line_stops = stops[stops["linia"] == line]
+        if line_stops.empty:
+            continue
+
+        names = []
+        for stop in line_stops.itertuples():
+            x, y = stop.x, stop.y
+            name = by_name.get(normalize_name(stop.nom))
+            if name is None and len(station_xy):
+                d = np.hypot(station_xy["x"].to_numpy() - x, station_xy["y"].to_numpy() - y)
+                if d.min() <= LINK_RADIUS_M:
+                    name = station_xy.index[int(np.argmin(d))]
+            if name is None:
+                name = stop.nom
+                station_xy.loc[name, ["x", "y", "lon", "lat"]] = [x, y, stop.lon, stop.lat]
+                by_name[normalize_name(name)] = name
+            if not names or names[-1] != name:
+                names.append(name)
+
+        current = [n for n, _ in sequences.get(line, [])]
+        if current:
+            # L'ampliació comença a l'extrem de la línia més proper a la primera parada nova
+            first = station_xy.loc[names[0], ["x", "y"]].to_numpy(dtype=float)
+            ends = station_xy.loc[[current[0], current[-1]], ["x", "y"]].to_numpy(dtype=float)
+            if np.hypot(*(ends[0] - first)) < np.hypot(*(ends[1] - first)):
+                current = current[::-1]
+            names = current + [n for n in names if n not in current]
+
+        # Es conserven els temps dels trams que ja existien
+        old = sequences.get(line, [])
+        known = {frozenset((a, b)): t for (a, _), (b, t) in zip(old[:-1], old[1:])}
+        xy = station_xy.loc[names, ["x", "y"]].to_numpy(dtype=float)
+        distances = np.hypot(*np.diff(xy, axis=0).T) * DETOUR_FACTOR
+        seq = [(names[0], 0.0)]
+        for prev, name, d in zip(names[:-1], names[1:], distances):
+            seq.append((name, known.get(frozenset((prev, name)), segment_minutes(d))))
+        sequences[line] = seq
+
+    return sequences, station_xy
+
+
+@dataclass
+class RouteTable:
+    """
+    Taula de recorreguts d'un escenari: temps mínim entre totes les parelles
+    d'estacions i predecessors per reconstruir el camí, calculats un sol cop.
+
+    El graf té un node per (estació, línia) i un node 'andana' per estació;
+    entrar o sortir de la línia costa mig transbord, de manera que canviar de
+    línia costa TRANSFER_PENALTY_MIN.
+    """
+    scenario: str
+    stations: list
+    station_index: dict
+    lookup: dict
+    node_station: np.ndarray
+    node_line: list
+    hubs: np.ndarray
+    minutes: np.ndarray
+    predecessors: np.ndarray
+    coords: dict
+
+    @classmethod
+    def build(cls, scenario: str, sequences: dict, station_xy: pd.DataFrame) -> "RouteTable":
+        stations = sorted(station_xy.index.tolist())
+        station_index = {name: i for i, name in enumerate(stations)}
+
+        node_station = list(range(len(stations)))
+        node_line = [None] * len(stations)
+        rows, cols, weights = [], [], []
+        half = TRANSFER_PENALTY_MIN / 2.0
+
+        for line, seq in sequences.items():
+            previous = None
+            for name, minutes in seq:
+                node = len(node_station)
+                node_station.append(station_index[name])
+                node_line.append(line)
+                rows.append(station_index[name]); cols.append(node); weights.append(half)
+                if previous is not None:
+                    rows.append(previous); cols.append(node); weights.append(minutes)
+                previous = node
+
+        n = len(node_station)
+        graph = coo_matrix((weights, (rows, cols)), shape=(n, n)).tocsr()
+        hubs = np.arange(len(stations))
+        dist, predecessors = dijkstra(graph, directed=False, indices=hubs, return_predecessors=True)
+
+        # Entre andanes: es descompta l'entrada i sortida (sense transbord)
+        minutes = dist[:, hubs] - TRANSFER_PENALTY_MIN
+        np.fill_diagonal(minutes, 0.0)
+
+        return cls(
+            scenario=scenario,
+            stations=stations,
+            station_index=station_index,
+            lookup={normalize_name(s): s for s in stations},
+            node_station=np.asarray(node_station),
+            node_line=node_line,
+            hubs=hubs,
+            minutes=minutes,
+            predecessors=predecessors,
+            coords={s: (float(station_xy.loc[s, "lon"]), float(station_xy.loc[s, "lat"])) for s in stations},
+        )
+
+    def resolve(self, name: str):
+        """Nom canònic de l'estació (sense distingir accents ni majúscules) o None."""
+        if name in self.station_index:
+            return name
+        return self.lookup.get(normalize_name(name))
+
+    def route(self, origin: str, destination: str):
+        """Recorregut més ràpid entre dues estacions, o None si no estan connectades."""
+        a, b = self.station_index[origin], self.station_index[destination]
+        total = self.minutes[a, b]
+        if not np.isfinite(total):
+            return None
+
+        path = []
+        node = b
+        while node != a and node >= 0:
+            path.append(node)
+            node = self.predecessors[a, node]
+        path.reverse()
+
+        legs = []
+        for node in path:
+            line = self.node_line[node]
+            if line is None:
+                continue
+            name = self.stations[self.node_station[node]]
+            if legs and legs[-1]["linia"] == line:
+                legs[-1]["parades"].append(name)
+            else:
+                legs.append({"linia": line, "parades": [name]})
+
+        for leg in legs:
+            leg["de"], leg["a"] = leg["parades"][0], leg["parades"][-1]
+            leg["num_parades"] = len(leg["parades"]) - 1
+
+        return {
+            "escenari": self.scenario,
+            "de": origin,
+            "a": destination,
+            "minuts": round(float(total), 1),
+            "transbords": max(len(legs) - 1, 0),
+            "trams": legs,
+        }
+
+
+def data_files_version():
+    """mtime dels traçats del graf i de la població servida (per invalidar la memòria cau)."""
+    paths = [METRO_LINES_FILE, *PROPOSALS.values(), CATCHMENTS_FILE]
+    return tuple(os.path.getmtime(p) if os.path.exists(p) else None for p in paths)
+
+
+def build_route_table(data, scenario: str) -> RouteTable:
+    """Graf i taula de recorreguts d'un escenari a partir d'una AnalyticsSnapshot."""
+    if scenario not in SCENARIOS:
+        raise ValueError(f"Escenari desconegut: {scenario} (vàlids: {', '.join(SCENARIOS)})")
+
+    to_utm = Transformer.from_crs("EPSG:4326", ROUTING_CRS, always_xy=True)
+    station_xy = data.station_coords.copy()
+    station_xy["x"], station_xy["y"] = to_utm.transform(station_xy["lon"].to_numpy(), station_xy["lat"].to_numpy())
+
+    sequences = line_sequences(station_xy, data.station_lines, load_line_geometries(to_utm=to_utm))
+    if SCENARIOS[scenario]:
+        stops = load_proposed_stops()
+        stops["x"], stops["y"] = to_utm.transform(stops["lon"].to_numpy(), stops["lat"].to_numpy())
+        sequences, station_xy = add_proposals(sequences, station_xy, stops, SCENARIOS[scenario])
+
+    return RouteTable.build(scenario, sequences, station_xy)
+
+
+def route_table(data, scenario: str = "actual") -> RouteTable:
+    """Taula de l'escenari lligada a la versió de dades, calculada un sol cop."""
+    return data.cached(("routes", scenario, data_files_version()), lambda: build_route_table(data, scenario))
+
+
+def format_route(route: dict) -> str:
+    """Recorregut en text, per al xatbot."""
+    if not route["trams"]:
+        return f"{route['de']} i {route['a']} són la mateixa estació."
+
+    lines = [f"De {route['de']} a {route['a']}: uns {route['minuts']:.0f} minuts, "
+             f"{route['transbords']} transbord{'s' if route['transbords'] != 1 else ''}."]
+    for i, leg in enumerate(route["trams"], start=1):
+        lines.append(f"{i}. {leg['linia']} de {leg['de']} a {leg['a']} ({leg['num_parades']} parades)")
+    return "\n".join(lines)
+
+
+def daily_ridership(data) -> pd.Series:
+    """Passatgers diaris mitjans per estació (PERSONA / dies amb dades)."""
+    def build():
+        days = max(int(data.df["DATA"].nunique()), 1)
+        return data.df.groupby("NOM_ESTACIO")["PERSONA"].sum() / days
+    return data.cached("daily_ridership", build)
+
+
+def catchment_population(path: str = CATCHMENTS_FILE):
+    """
+    (població per nom, radi) amb el radi més gran de catchments.csv
+    (python catchment.py). Sèrie buida si el fitxer no hi és.
+    """
+    if not os.path.exists(path):
+        return pd.Series(dtype=float), None
+    table = pd.read_csv(path, keep_default_na=False)
+    columns = sorted((c for c in table.columns if c.startswith("poblacio_")), key=lambda c: int(c.split("_")[1]))
+    if not columns:
+        return pd.Series(dtype=float), None
+    return table.groupby("nom")[columns[-1]].max().astype(float), int(columns[-1].split("_")[1])
+
+
+def new_stop_demand(data, names: list, new: list):
+    """
+    Passatgers diaris estimats de les parades noves: població servida per
+    passatgers per resident de les estacions actuals (mateix radi). Sense
+    població per calibrar-ho, cada parada nova rep la mediana de les actuals.
+    Retorna (demanda per parada nova, població per parada nova, radi, mètode).
+    """
+    population, radius = catchment_population()
+    riders = daily_ridership(data).reindex(names).fillna(0.0)
+    served = population.reindex(names).fillna(0.0)
+    known = served > 0
+    new_population = population.reindex(new).fillna(0.0).to_numpy()
+
+    if known.any():
+        rate = float(riders[known].sum() / served[known].sum())
+        return new_population * rate, new_population, radius, "poblacio"
+    return np.full(len(new), float(riders.median()) if len(riders) else 0.0), new_population, radius, "mediana"
+
+
+def compare_scenario(data, scenario: str, top: int = 10) -> dict:
+    """
+    Compara els temps de tots els parells d'estacions existents entre la xarxa
+    actual i un escenari. Cada parell es pondera amb un model gravitatori sobre
+    els passatgers diaris: T_ij = P_i · P_j / ΣP (viatges estimats de i a j).
+
+    Les parades noves no tenen temps de referència a la xarxa actual: la seva
+    demanda s'estima amb la població servida (new_stop_demand) i es mostra a
+    part com a viatges que guanyen accés al metro.
+    """
+    base = route_table(data, "actual")
+    other = route_table(data, scenario)
+
+    names = base.stations
+    idx = np.array([other.station_index[n] for n in names])
+    before = base.minutes
+    after = other.minutes[np.ix_(idx, idx)]
+
+    new = [s for s in other.stations if s not in base.station_index]
+    new_idx = np.array([other.station_index[n] for n in new], dtype=int)
+    new_riders, new_population, radius, demand_method = new_stop_demand(data, names, new)
+
+    riders = daily_ridership(data).reindex(names).fillna(0.0).to_numpy()
+    total_riders = max(riders.sum() + new_riders.sum(), 1.0)
+    trips = np.outer(riders, riders) / total_riders
+    # Només els parells connectats en tots dos escenaris; la resta no entra a cap resta ni mitjana
+    valid = np.isfinite(before) & np.isfinite(after)
+    np.fill_diagonal(valid, False)
+    trips = np.where(valid, trips, 0.0)
+    before_valid = np.where(valid, before, 0.0)
+    after_valid = np.where(valid, after, 0.0)
+    saved = before_valid - after_valid
+
+    total_trips = trips.sum()
+    weighted = (lambda m: float((m * trips).sum() / total_trips) if total_trips else 0.0)
+
+    # Parells i estacions que més hi guanyen
+    order = np.argsort(saved, axis=None)[::-1][: top * 2]
+    best_pairs = []
+    for flat in order:
+        i, j = np.unravel_index(flat, saved.shape)
+        if saved[i, j] <= 0 or i > j:
+            continue
+        best_pairs.append({
+            "de": names[i],
+            "a": names[j],
+            "minuts_actual": round(float(before[i, j]), 1),
+            "minuts_escenari": round(float(after[i, j]), 1),
+            "minuts_estalviats": round(float(saved[i, j]), 1),
+        })
+    by_station = (saved * trips).sum(axis=1) / np.maximum(trips.sum(axis=1), 1e-9)
+    best_stations = [
+        {"estacio": names[i], "minuts_estalviats_per_viatge": round(float(by_station[i]), 2)}
+        for i in np.argsort(by_station)[::-1][:top] if by_station[i] > 0
+    ]
+
+    # Accés nou: viatges de cada parada nova a la resta de la xarxa de l'escenari
+    all_riders = np.zeros(len(other.stations))
+    all_riders[idx] = riders
+    all_riders[new_idx] = new_riders
+    new_trips = np.outer(new_riders, all_riders) / total_riders
+    new_times = other.minutes[new_idx]
+    reachable = np.isfinite(new_times)
+    reachable[np.arange(len(new)), new_idx] = False
+    new_trips = np.where(reachable, new_trips, 0.0)
+    new_times = np.where(reachable, new_times, 0.0)
+    # Els parells entre dues parades noves es comptarien dues vegades
+    is_new = np.isin(np.arange(len(other.stations)), new_idx)
+    new_stops = [
+        {
+            "parada": name,
+            "poblacio": int(round(new_population[k])),
+            "viatges_diaris": round(float(new_trips[k].sum()), 1),
+            "minuts_mitjans": round(float((new_times[k] * new_trips[k]).sum()
+                                          / new_trips[k].sum()), 1) if new_trips[k].sum() else None,
+        }
+        for k, name in enumerate(new)
+    ]
+
+    return {
+        "escenari": scenario,
+        "estacions_noves": new,
+        "radi_poblacio_m": radius,
+        "demanda_noves_parades": demand_method,
+        "noves_parades": new_stops,
+        "viatges_nous_diaris": round(float(new_trips[:, ~is_new].sum() + new_trips[:, is_new].sum() / 2), 1),
+        "parells": int(valid.sum()),
+        "parells_millorats": int((saved > 1e-9).sum()),
+        "minuts_mitjans_actual": round(weighted(before_valid), 2),
+        "minuts_mitjans_escenari": round(weighted(after_valid), 2),
+        "minuts_estalviats_per_viatge": round(weighted(saved), 3),
+        "hores_estalviades_diaries": round(float((saved * trips).sum()) / 60.0, 1),
+        "millors_parells": best_pairs[:top],
+        "millors_estacions": best_stations,
+    }
+
+
+def scenario_comparison(data, scenario: str) -> dict:
+    """Comparació d'un escenari amb la xarxa actual, calculada un sol cop per versió de dades."""
+    if scenario not in SCENARIOS:
+        raise ValueError(f"Escenari desconegut: {scenario} (vàlids: {', '.join(SCENARIOS)})")
+    return data.cached(("scenario_comparison", scenario, data_files_version()), lambda: compare_scenario(data, scenario))
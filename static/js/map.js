@@ -87,6 +87,68 @@ function buildMetroLegend() {
     `;
 }
 
+// Capes de dades: nom de la capa dins l'arxiu de tessel·les i GeoJSON alternatiu
+const DATA_SOURCES = {
+    'barcelona-buildings': { layer: 'buildings', geojson: null },
+    'metro-lines': { layer: 'metro_lines', geojson: 'static/data/barcelona_metro_lines.geojson' },
+    'metro-stops': { layer: 'estacions', geojson: 'static/data/estacions.geojson' },
+    'station-demand-source': { layer: 'estacions', geojson: 'static/data/estacions.geojson' },
+    'ampliacio-l1-source': { layer: 'ampliacio_l1', geojson: 'static/data/ampliacio_l1.geojson' },
+    'l12-source': { layer: 'l12', geojson: 'static/data/L12.geojson' },
+    'ferros-layer': { layer: 'ferros_lines', geojson: 'static/data/ferros_lines.geojson' }
+};
+const TILE_ARCHIVE_SOURCE = 'smartmetro-tiles';
+let useTileArchive = false;
+
+/**
+ * Si el servidor té l'arxiu MBTiles generat (python tiles.py), totes les capes
+ * surten d'una única font vectorial; si no, es carreguen els GeoJSON.
+ */
+async function addDataSources() {
+    try {
+        const res = await fetch('/tiles/smartmetro.json');
+        if (res.ok) {
+            const tilejson = await res.json();
+            map.addSource(TILE_ARCHIVE_SOURCE, {
+                'type': 'vector',
+                'tiles': tilejson.tiles,
+                'minzoom': tilejson.minzoom,
+                'maxzoom': tilejson.maxzoom
+            });
+            useTileArchive = true;
+            return;
+        }
+    } catch (err) {
+        console.warn("No s'ha pogut llegir l'arxiu de tessel·les, es fan servir GeoJSON.", err);
+    }
+
+    Object.entries(DATA_SOURCES).forEach(([sourceId, cfg]) => {
+        if (cfg.geojson) {
+            map.addSource(sourceId, { 'type': 'geojson', 'data': cfg.geojson });
+        }
+    });
+    // Els edificis sempre tenen servidor de tessel·les propi
+    map.addSource('barcelona-buildings', {
+        'type': 'vector',
+        'tiles': [`${window.location.origin}/tiles/buildings/{z}/{x}/{y}.pbf`],
+        'minzoom': 12,
+        'maxzoom': 16
+    });
+}
+
+/**
+ * Propietats 'source' (i 'source-layer' si cal) per a una capa del mapa.
+ */
+function dataSource(sourceId) {
+    if (useTileArchive) {
+        return { 'source': TILE_ARCHIVE_SOURCE, 'source-layer': DATA_SOURCES[sourceId].layer };
+    }
+    if (sourceId === 'barcelona-buildings') {
+        return { 'source': sourceId, 'source-layer': 'buildings' };
+    }
+    return { 'source': sourceId };
+}
+
 function toggleMetroLegend(show) {
     if (!metroLegend) return;
     metroLegend.style.display = show ? 'block' : 'none';
@@ -121,7 +183,7 @@ function initializeMap() {
     map.addControl(new maplibregl.NavigationControl({ showCompass: true, showZoom: true }), 'top-left');
     map.addControl(new maplibregl.ScaleControl({ unit: 'metric' }), 'bottom-left');
 
-    map.on('load', () => {
+    map.on('load', async () => {
 
         // ==========================================================
         // BLOC TERRENY 3D (DTM) DE MAPTILER
@@ -172,15 +234,14 @@ function initializeMap() {
         });
         buildMetroLegend();
 
-        // --- Capa Edificios 3D (GeoJSON) ---
-        map.addSource('barcelona-buildings', {
-            'type': 'geojson',
-            'data': 'static/data/buildings.geojson'
-        });
+        // --- Fonts de dades (arxiu de tessel·les o GeoJSON) ---
+        await addDataSources();
+
+        // --- Capa Edificios 3D (Vector Tiles servides per FastAPI) ---
         map.addLayer({
             'id': 'buildings-3d-layer',
             'type': 'fill-extrusion',
-            'source': 'barcelona-buildings',
+            ...dataSource('barcelona-buildings'),
             'layout': { 'visibility': 'visible' },
             'paint': {
                 'fill-extrusion-color': '#cccccc',
@@ -191,14 +252,10 @@ function initializeMap() {
         });
         
         // --- Capa Líneas de Metro (GeoJSON) ---
-        map.addSource('metro-lines', {
-            'type': 'geojson',
-            'data': 'static/data/barcelona_metro_lines.geojson'
-        });
         map.addLayer({
             'id': 'metro-lines-layer',
             'type': 'line',
-            'source': 'metro-lines',
+            ...dataSource('metro-lines'),
             'layout': { 'visibility': 'none', 'line-join': 'round', 'line-cap': 'round' },
             'paint': {
                 'line-color': ['concat', '#', ['get', 'COLOR_LINIA']],
@@ -207,14 +264,10 @@ function initializeMap() {
         });
         
         // --- Capa Paradas de Metro (Puntos Rojos Simples) ---
-        map.addSource('metro-stops', {
-            'type': 'geojson',
-            'data': 'static/data/estacions.geojson'
-        });
         map.addLayer({
             'id': 'metro-stops-layer',
             'type': 'circle',
-            'source': 'metro-stops',
+            ...dataSource('metro-stops'),
             'layout': { 'visibility': 'none' },
             'paint': {
                 'circle-radius': 6,
@@ -224,23 +277,20 @@ function initializeMap() {
             }
         });
         
-        // --- Fuente de Datos de Población (Puntos) ---
-        map.addSource('population-points', {
+        // --- Fuente de Población agregada en celdas (se llena según el viewport) ---
+        map.addSource('population-grid', {
             'type': 'geojson',
-            'data': 'static/data/population_points.geojson'
+            'data': { 'type': 'FeatureCollection', 'features': [] }
         });
-        
+
         // --- Capa Mapa de Calor de Población (Heatmap) ---
         map.addLayer({
             'id': 'population-heatmap-layer',
             'type': 'heatmap',
-            'source': 'population-points', 
+            'source': 'population-grid',
             'layout': { 'visibility': 'none' },
             'paint': {
-                'heatmap-weight': [
-                    'interpolate', ['linear'], ['get', 'poblacion_estimada'],
-                    0, 0, 100, 1 
-                ],
+                'heatmap-weight': ['get', 'pes'],
                 'heatmap-intensity': 0.4, 
                 'heatmap-radius': 15,
                 'heatmap-color': [
@@ -253,14 +303,10 @@ function initializeMap() {
         });
 
         // --- Capa de Demanda d'Estacions (Persones) ---
-        map.addSource('station-demand-source', {
-            'type': 'geojson',
-            'data': 'static/data/estacions.geojson'
-        });
         map.addLayer({
             'id': 'station-demand-layer',
             'type': 'circle',
-            'source': 'station-demand-source',
+            ...dataSource('station-demand-source'),
             'layout': { 'visibility': 'none' },
             'paint': {
                 'circle-radius': [
@@ -278,14 +324,10 @@ function initializeMap() {
         });
 
         // --- Capa de Ampliación L1 ---
-        map.addSource('ampliacio-l1-source', {
-            'type': 'geojson',
-            'data': 'static/data/ampliacio_l1.geojson'
-        });
         map.addLayer({
             'id': 'ampliacio-l1-layer',
             'type': 'line',
-            'source': 'ampliacio-l1-source',
+            ...dataSource('ampliacio-l1-source'),
             'layout': { 'visibility': 'none' },
             'paint': {
                 'line-color': '#CE1126',
@@ -295,14 +337,10 @@ function initializeMap() {
         });
 
         // --- Capa L12 ---
-        map.addSource('l12-source', {
-            'type': 'geojson',
-            'data': 'static/data/L12.geojson'
-        });
         map.addLayer({
             'id': 'l12-layer',
             'type': 'line',
-            'source': 'l12-source',
+            ...dataSource('l12-source'),
             'layout': { 'visibility': 'none' },
             'paint': {
                 'line-color': '#48918dff',
@@ -311,14 +349,10 @@ function initializeMap() {
             }
         });
 
-        map.addSource('ferros-layer', {
-            'type': 'geojson',
-            'data': 'static/data/ferros_lines.geojson'
-        });
         map.addLayer({
             'id': 'ferros-layer',
             'type': 'line',
-            'source': 'ferros-layer',
+            ...dataSource('ferros-layer'),
             'layout': { 'visibility': 'none', 'line-join': 'round', 'line-cap': 'round' },
             'paint': {
                 'line-color': ['concat', '#', ['get', 'route_color']],
@@ -346,6 +380,11 @@ function initializeMap() {
              map.moveLayer('buildings-3d-layer');
         }
 
+        // Actualitza la graella de població quan es mou el mapa
+        map.on('moveend', () => {
+            if (populationHeatmapCheckbox.checked) refreshPopulationGrid();
+        });
+
         // --- Interacció del Mapa (Popups i Cursos) ---
         
         // Popups per a la Demanda d'Estacions
@@ -375,6 +414,27 @@ function initializeMap() {
     }); // Fi de map.on('load')
 }
 
+/**
+ * Demana al servidor la població agregada del viewport actual.
+ */
+let populationGridRequest = null;
+async function refreshPopulationGrid() {
+    if (!map || !map.getSource('population-grid')) return;
+    const b = map.getBounds();
+    const bbox = [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()].map(v => v.toFixed(5)).join(',');
+    const url = `/api/population-grid?bbox=${bbox}&zoom=${map.getZoom().toFixed(2)}`;
+
+    if (populationGridRequest) populationGridRequest.abort();
+    populationGridRequest = new AbortController();
+    try {
+        const res = await fetch(url, { signal: populationGridRequest.signal });
+        if (!res.ok) return;
+        map.getSource('population-grid').setData(await res.json());
+    } catch (err) {
+        if (err.name !== 'AbortError') console.warn('Error carregant la graella de població', err);
+    }
+}
+
 /**
  * Canvia la visibilitat dels mapes base.
  */
@@ -459,6 +519,7 @@ populationHeatmapCheckbox.addEventListener('change', (e) => {
     const isVisible = e.target.checked;
     map.setLayoutProperty('population-heatmap-layer', 'visibility', isVisible ? 'visible' : 'none');
     heatmapSliderContainer.style.display = isVisible ? 'flex' : 'none';
+    if (isVisible) refreshPopulationGrid();
 });
 
 heatmapRadiusSlider.addEventListener('input', (e) => {
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import poblacion
+
+
+def edificio(i, viviendas, uso="1_residential"):
+    x, y = 2.15 + i * 0.001, 41.39
+    return {
+        "type": "Feature",
+        "properties": {
+            "gml_id": f"b{i}",
+            "reference": f"REF{i}",
+            "value": 100 + i,
+            "currentUse": uso,
+            "numberOfDwellings": viviendas,
+        },
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [[[x, y], [x + 0.0005, y], [x + 0.0005, y + 0.0005], [x, y + 0.0005], [x, y]]],
+        },
+    }
+
+
+def ejecutar(modo, entrada, tmp_path, monkeypatch):
+    salida = tmp_path / f"puntos_{modo}.geojson"
+    monkeypatch.setattr(poblacion, "input_file", str(entrada))
+    monkeypatch.setattr(poblacion, "output_file", str(salida))
+    monkeypatch.setattr(poblacion, "grid_file", str(tmp_path / f"grid_{modo}.json"))
+    poblacion.MODOS[modo]()
+    with open(salida, encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.mark.skipif(poblacion.gpd is None, reason="el modo vectorial necesita geopandas")
+def test_vectorial_igual_que_memoria_con_viviendas_mixtas(tmp_path, monkeypatch):
+    # Números, decimales, textos, booleanos y nulos en la misma columna:
+    # GDAL lee la columna entera como texto
+    valores = [2.7000000000000002, "3", 2.0, "abc", None, True, 5, "", -1.5, 12]
+    features = [edificio(i, v) for i, v in enumerate(valores)]
+    features.append(edificio(len(valores), 40, uso="3_industrial"))
+    entrada = tmp_path / "buildings.geojson"
+    entrada.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+
+    memoria = ejecutar("memoria", entrada, tmp_path, monkeypatch)
+    vectorial = ejecutar("vectorial", entrada, tmp_path, monkeypatch)
+
+    props = lambda fc: [f["properties"] for f in fc["features"]]
+    assert [p["viviendas"] for p in props(vectorial)] == [p["viviendas"] for p in props(memoria)]
+    assert [p["poblacion_estimada"] for p in props(vectorial)] == pytest.approx(
+        [p["poblacion_estimada"] for p in props(memoria)]
+    )
@@ -0,0 +1,48 @@
+import gzip
+import json
+import sqlite3
+
+import mapbox_vector_tile
+from fastapi.testclient import TestClient
+
+import main
+from tiles import MBTilesArchive, VectorTileLayer, build_mbtiles, lonlat_to_tile
+
+
+def write_geojson(path, features):
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+
+
+def test_build_mbtiles_layer_without_properties(tmp_path, monkeypatch):
+    # Com ampliacio_l1.geojson: línia amb 'properties' buit
+    source = tmp_path / "linia.geojson"
+    write_geojson(source, [{
+        "type": "Feature",
+        "properties": {},
+        "geometry": {"type": "LineString", "coordinates": [[2.20, 41.44], [2.23, 41.45]]},
+    }])
+    output = tmp_path / "mapa.mbtiles"
+
+    layer = VectorTileLayer("ampliacio_l1", str(source))
+    build_mbtiles(str(output), layers=[layer], min_zoom=12, max_zoom=13)
+
+    with sqlite3.connect(output) as conn:
+        count = conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+    assert count > 0
+
+    # L'endpoint serveix les tessel·les tal qual, comprimides amb gzip
+    monkeypatch.setattr(main, "TILE_ARCHIVE", MBTilesArchive(str(output)))
+    x, y = lonlat_to_tile(2.20, 41.44, 13)
+    with TestClient(main.app).stream("GET", f"/tiles/13/{x}/{y}.pbf") as resp:
+        raw = b"".join(resp.iter_raw())
+
+    assert resp.status_code == 200
+    assert resp.headers["content-encoding"] == "gzip"
+    assert resp.headers["content-type"] == main.MVT_MEDIA_TYPE
+
+    decoded = mapbox_vector_tile.decode(gzip.decompress(raw))
+    assert list(decoded) == ["ampliacio_l1"]
+    features = decoded["ampliacio_l1"]["features"]
+    assert len(features) == 1
+    assert features[0]["properties"] == {}
+    assert features[0]["geometry"]["type"] == "LineString"
@@ -0,0 +1,360 @@
+import argparse
+import gzip
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import geopandas as gpd
+    import mapbox_vector_tile
+    import shapely
+except ImportError:
+    # Sense aquestes llibreries el servidor funciona però no serveix tessel·les
+    gpd = None
+    mapbox_vector_tile = None
+    shapely = None
+
+
+DATA_DIR = os.path.join("static", "data")
+MBTILES_FILE = os.path.join(DATA_DIR, "smartmetro.mbtiles")
+
+# Web Mercator (EPSG:3857)
+WORLD_HALF = 20037508.342789244
+TILE_EXTENT = 4096
+# Marge al voltant de la tessel·la perquè les vores no es vegin tallades
+TILE_BUFFER = 64
+
+
+def tile_bounds(z: int, x: int, y: int):
+    """Límits (minx, miny, maxx, maxy) d'una tessel·la XYZ en EPSG:3857."""
+    size = 2 * WORLD_HALF / (1 << z)
+    minx = -WORLD_HALF + x * size
+    maxy = WORLD_HALF - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def lonlat_to_tile(lon: float, lat: float, z: int):
+    """Tessel·la XYZ que conté un punt lon/lat."""
+    n = 1 << z
+    x = int((lon + 180.0) / 360.0 * n)
+    lat_rad = math.radians(lat)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def clean_properties(row: dict) -> dict:
+    """Propietats vàlides per a MVT: sense nuls ni NaN i amb tipus simples."""
+    props = {}
+    for key, value in row.items():
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            continue
+        if hasattr(value, "item"):
+            value = value.item()
+        if not isinstance(value, (str, int, float, bool)):
+            value = str(value)
+        props[key] = value
+    return props
+
+
+class VectorTileLayer:
+    """
+    Capa GeoJSON servida com a Mapbox Vector Tiles.
+
+    El fitxer es carrega la primera vegada que es demana una tessel·la, es
+    reprojecta a EPSG:3857 i s'indexa amb un STRtree. Cada tessel·la només
+    consulta l'índex, retalla, simplifica segons el zoom i codifica.
+    """
+
+    def __init__(self, name: str, path: str, properties=None, min_zoom: int = 0, max_zoom: int = 16,
+                 simplify_px: float = 1.0, min_area_px: float = 0.0, cache_size: int = 2048):
+        self.name = name
+        self.path = path
+        self.properties = properties
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.simplify_px = simplify_px
+        self.min_area_px = min_area_px
+        self.cache_size = cache_size
+
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._geoms = None
+        self._props = None
+        self._tree = None
+        self._cache = OrderedDict()
+
+    @property
+    def available(self) -> bool:
+        return gpd is not None and os.path.exists(self.path)
+
+    def _load(self):
+        """Carrega (o recarrega si el fitxer ha canviat) les geometries i l'índex."""
+        mtime = os.path.getmtime(self.path)
+        if self._tree is not None and mtime == self._mtime:
+            return
+
+        with self._lock:
+            if self._tree is not None and mtime == self._mtime:
+                return
+
+            gdf = gpd.read_file(self.path)
+            gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+            if gdf.crs is not None:
+                gdf = gdf.to_crs("EPSG:3857")
+            else:
+                gdf = gdf.set_crs("EPSG:4326").to_crs("EPSG:3857")
+
+            columns = [c for c in (self.properties or gdf.columns) if c in gdf.columns and c != "geometry"]
+            # Sense columnes to_dict retorna [] en lloc d'un diccionari buit per fila
+            self._props = gdf[columns].to_dict(orient="records") if columns else [{} for _ in range(len(gdf))]
+            self._geoms = gdf.geometry.values
+            self._tree = shapely.STRtree(self._geoms)
+            self._cache.clear()
+            self._mtime = mtime
+
+    def features(self, z: int, x: int, y: int):
+        """Geometries (EPSG:3857) i propietats de la capa dins d'una tessel·la."""
+        self._load()
+        bounds = tile_bounds(z, x, y)
+        size = bounds[2] - bounds[0]
+        pixel = size / TILE_EXTENT
+        margin = TILE_BUFFER * pixel
+        clip = (bounds[0] - margin, bounds[1] - margin, bounds[2] + margin, bounds[3] + margin)
+
+        idx = self._tree.query(shapely.box(*clip))
+        if len(idx) == 0:
+            return []
+        idx.sort()
+
+        geoms = self._geoms[idx]
+        # A zooms baixos es descarten els polígons més petits que un píxel
+        if self.min_area_px and z < self.max_zoom:
+            area = shapely.area(geoms)
+            keep = (area == 0) | (area >= self.min_area_px * pixel * pixel)
+            idx, geoms = idx[keep], geoms[keep]
+
+        if self.simplify_px and z < self.max_zoom:
+            geoms = shapely.simplify(geoms, self.simplify_px * pixel, preserve_topology=True)
+        geoms = shapely.clip_by_rect(geoms, *clip)
+
+        return [
+            {"geometry": g, "properties": clean_properties(self._props[i])}
+            for i, g in zip(idx, geoms)
+            if not g.is_empty
+        ]
+
+    def tile(self, z: int, x: int, y: int) -> bytes:
+        """Tessel·la MVT codificada (b'' si és buida o fora del rang de zoom)."""
+        if z < self.min_zoom or not self.available:
+            return b""
+
+        self._load()
+        key = (z, x, y)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        data = encode_tile([self], z, x, y)
+
+        with self._lock:
+            self._cache[key] = data
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return data
+
+
+def encode_tile(layers, z: int, x: int, y: int) -> bytes:
+    """Codifica una o més capes en una única tessel·la MVT."""
+    encoded_layers = []
+    for layer in layers:
+        if z < layer.min_zoom or not layer.available:
+            continue
+        features = layer.features(z, x, y)
+        if features:
+            encoded_layers.append({"name": layer.name, "features": features})
+
+    if not encoded_layers:
+        return b""
+
+    return mapbox_vector_tile.encode(
+        encoded_layers,
+        default_options={"quantize_bounds": tile_bounds(z, x, y), "extents": TILE_EXTENT},
+    )
+
+
+BUILDINGS_LAYER = VectorTileLayer(
+    "buildings",
+    os.path.join(DATA_DIR, "buildings.geojson"),
+    properties=["reference", "currentUse", "numberOfDwellings"],
+    min_zoom=12,
+    max_zoom=16,
+    simplify_px=1.0,
+    min_area_px=4.0,
+)
+
+# Totes les capes del mapa, tal com es couen a l'arxiu MBTiles
+MAP_LAYERS = [
+    BUILDINGS_LAYER,
+    VectorTileLayer(
+        "estacions",
+        os.path.join(DATA_DIR, "estacions.geojson"),
+        properties=["NOM_ESTACIO", "PICTO", "PERSONA"],
+        simplify_px=0,
+    ),
+    VectorTileLayer("metro_lines", os.path.join(DATA_DIR, "barcelona_metro_lines.geojson")),
+    VectorTileLayer("ferros_lines", os.path.join(DATA_DIR, "ferros_lines.geojson")),
+    VectorTileLayer("l12", os.path.join(DATA_DIR, "L12.geojson")),
+    VectorTileLayer("ampliacio_l1", os.path.join(DATA_DIR, "ampliacio_l1.geojson")),
+]
+
+
+def layer_bounds(layers):
+    """Extensió conjunta (EPSG:3857) de totes les capes disponibles."""
+    bounds = None
+    for layer in layers:
+        if not layer.available:
+            continue
+        layer._load()
+        if len(layer._geoms) == 0:
+            continue
+        b = shapely.total_bounds(layer._geoms)
+        bounds = b if bounds is None else (
+            min(bounds[0], b[0]), min(bounds[1], b[1]), max(bounds[2], b[2]), max(bounds[3], b[3])
+        )
+    return bounds
+
+
+def mercator_to_lonlat(mx: float, my: float):
+    lon = mx / WORLD_HALF * 180.0
+    lat = math.degrees(math.atan(math.sinh(my / WORLD_HALF * math.pi)))
+    return lon, lat
+
+
+def build_mbtiles(output: str = MBTILES_FILE, layers=None, min_zoom: int = 10, max_zoom: int = 16):
+    """
+    Cou totes les capes en un sol arxiu MBTiles (SQLite) amb tessel·les MVT
+    comprimides amb gzip, a tots els zooms entre min_zoom i max_zoom.
+    """
+    layers = [l for l in (layers or MAP_LAYERS) if l.available]
+    if not layers:
+        print("No hi ha cap capa disponible a", DATA_DIR)
+        return
+
+    print("Capes:", ", ".join(l.name for l in layers))
+    bounds = layer_bounds(layers)
+    west, south = mercator_to_lonlat(bounds[0], bounds[1])
+    east, north = mercator_to_lonlat(bounds[2], bounds[3])
+
+    tmp_output = output + ".tmp"
+    if os.path.exists(tmp_output):
+        os.remove(tmp_output)
+    conn = sqlite3.connect(tmp_output)
+    conn.executescript("""
+        CREATE TABLE metadata (name TEXT, value TEXT);
+        CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+    """)
+
+    vector_layers = [
+        {"id": l.name, "fields": {}, "minzoom": max(l.min_zoom, min_zoom), "maxzoom": max_zoom}
+        for l in layers
+    ]
+    metadata = {
+        "name": "smartmetro",
+        "format": "pbf",
+        "type": "overlay",
+        "minzoom": str(min_zoom),
+        "maxzoom": str(max_zoom),
+        "bounds": f"{west:.6f},{south:.6f},{east:.6f},{north:.6f}",
+        "center": f"{(west + east) / 2:.6f},{(south + north) / 2:.6f},{min_zoom + 2}",
+        "json": json.dumps({"vector_layers": vector_layers}),
+    }
+    conn.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+
+    start = time.time()
+    for z in range(min_zoom, max_zoom + 1):
+        x0, y0 = lonlat_to_tile(west, north, z)
+        x1, y1 = lonlat_to_tile(east, south, z)
+        written = 0
+        for x in range(x0, x1 + 1):
+            rows = []
+            for y in range(y0, y1 + 1):
+                data = encode_tile(layers, z, x, y)
+                if data:
+                    # MBTiles fa servir l'esquema TMS (fila invertida)
+                    rows.append((z, x, (1 << z) - 1 - y, gzip.compress(data)))
+            conn.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", rows)
+            written += len(rows)
+        conn.commit()
+        print(f" z{z}: {written} tessel·les ({time.time() - start:.1f}s)")
+
+    conn.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+    conn.commit()
+    conn.close()
+    os.replace(tmp_output, output)
+    print(f"Arxiu generat: {output}")
+
+
+class MBTilesArchive:
+    """Lector d'un arxiu MBTiles; obre una connexió de només lectura per fil."""
+
+    def __init__(self, path: str = MBTILES_FILE):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def available(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _conn(self):
+        mtime = os.path.getmtime(self.path)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.mtime != mtime:
+            if conn is not None:
+                conn.close()
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+            self._local.mtime = mtime
+        return conn
+
+    def tile(self, z: int, x: int, y: int):
+        """Bytes gzip de la tessel·la XYZ, o None si no n'hi ha."""
+        row = self._conn().execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, (1 << z) - 1 - y),
+        ).fetchone()
+        return row[0] if row else None
+
+    def metadata(self) -> dict:
+        return dict(self._conn().execute("SELECT name, value FROM metadata").fetchall())
+
+    def tilejson(self, tiles_url: str) -> dict:
+        meta = self.metadata()
+        tilejson = {
+            "tilejson": "3.0.0",
+            "name": meta.get("name"),
+            "tiles": [tiles_url],
+            "minzoom": int(meta.get("minzoom", 0)),
+            "maxzoom": int(meta.get("maxzoom", 16)),
+            "bounds": [float(v) for v in meta["bounds"].split(",")] if "bounds" in meta else None,
+        }
+        if "json" in meta:
+            tilejson.update(json.loads(meta["json"]))
+        return tilejson
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera l'arxiu MBTiles amb totes les capes del mapa.")
+    parser.add_argument("--output", default=MBTILES_FILE)
+    parser.add_argument("--minzoom", type=int, default=10)
+    parser.add_argument("--maxzoom", type=int, default=16)
+    args = parser.parse_args()
+
+    if gpd is None:
+        print("Error: calen 'geopandas', 'shapely' i 'mapbox-vector-tile'.")
+        raise SystemExit(1)
+    build_mbtiles(args.output, min_zoom=args.minzoom, max_zoom=args.maxzoom)